@@ -23,6 +23,7 @@ def main() -> None:
     unpacked_root = os.path.join(working_directory, settings.UNPACKED_ROOT)
     decima_explorer_cli = os.path.join(working_directory, settings.DECIMA_EXPLORER_CLI)
     sentences_root = os.path.join(unpacked_root, "localized", "sentences")
+    cache_folder = os.path.join(working_directory, settings.CACHE_FOLDER)
 
     with open(sentence_dumper_settings, "w") as file:
         file.write(unpacked_root)
@@ -57,13 +58,19 @@ def main() -> None:
     # Example command from decima-scripts documentation:
     # python sentence_dumper.py "C:\HZD\localized\sentences\aigenerated"
     # Note that -l [Languagename] is also required for any language that isn't english
+    # -c [cache folder] shares the parsed scenes with 03_Build_Transcript.py so they are only decoded once
+    # -d text skips writing the at9 files, which 03_Build_Transcript.py doesn't need if it reads the audio from the .stream files
     command = [
         "python",
         os.path.join(sentence_dumper_root, "sentence_dumper.py"),
         sentences_root,
         "-l",
         tl_name,
+        "-c",
+        cache_folder,
     ]
+    if settings.AUDIO_FROM_STREAM:
+        command += ["-d", "text"]
     run_py_script(command)
 
     print("Done! You can now move on to the next command.")
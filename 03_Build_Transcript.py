@@ -3,25 +3,128 @@ This script is part of a group of scripts. Please see README.MD.
 Settings can be modified in settings.py
 """
 
+import io
 import os
 import re
+import csv
+import json
+import itertools
+import collections
+import time
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 import pydecima
-from pydecima.resources import SentenceResource
 from pydecima.enums import ETextLanguages
 
 import pandas as pd
-
-from pydub import AudioSegment
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
 
 import settings
-from support import delete_file, file_exists, make_dir, run_command
+from audio_converter import (
+    AT9_AUDIO_TYPES,
+    AUDIO_JOURNAL_FILENAME,
+    AUDIO_LEDGER_FILENAME,
+    AUDIO_LOG_FILENAME,
+    AudioConverter,
+    convert_journal,
+    create_audio_backend,
+    get_audio_extension,
+    get_stream_source,
+    is_audio_playable,
+    scan_at9_header,
+    start_background_conversion,
+)
+from audio_server import get_audio_server_url
+from corpus_db import (
+    create_corpus_db,
+    finish_corpus_db,
+    get_corpus_db_path,
+    insert_lines,
+    write_corpus_db,
+)
+from scene_cache import (
+    SCENE_CACHE_VERSION,
+    get_audio_language,
+    get_reference_file_stat,
+    get_reference_stats,
+    get_voice_file_stats,
+    get_voice_name,
+    load_scene,
+)
+from stream_index import get_stream_path
+from support import file_exists, get_file_stat, hash_file, make_dir, write_json
+
+MANIFEST_VERSION = 4
+
+TOC_PLACEHOLDER = "{{INSERT_TOC_HERE}}"
+CONTENT_PLACEHOLDER = "{{INSERT_CONTENT_HERE}}"
+INSTRUCTIONS_PLACEHOLDER = "{{INSERT INSTRUCTIONS HERE}}"
+CONTENT_END_HTML = "</tbody></table></div></article></section>\n"
+
+# Markup around each chapter and scene of the transcript, shared by render_content_row and render_content_rows
+CHAPTER_START_HTML = '<section id="{chapter_code}"><div class="row"><h1 class="col">{chapter}</h1></div>\n'
+SCENE_START_HTML = '<article class="row" id="{scene}"><div class="col"><h2 class="fw-lighter text-body-secondary">{scene}</h2><table class="table table-borderless table-sm"><thead><th style="width: 10%"></th><th></th></thead><tbody>\n'
+SCENE_END_HTML = "</tbody></table></div></article>\n"
+
+# Markup for a single line for each toggle_nl setting, anything else is treated as "off"
+ROW_HTML = {
+    "toggle": '<tr><th onclick="playAudio(\'{audio_html_path}\')">{speaker}</th><td><span data-bs-toggle="collapse" role="button" href="#{line}">{target_language}</span><div class="collapse fw-lighter text-body-secondary fst-italic" id="{line}">{native_language}</div></td></tr>\n',
+    "shown": '<tr><th onclick="playAudio(\'{audio_html_path}\')">{speaker}</th><td><span>{target_language}</span><div class="fw-lighter text-body-secondary fst-italic" id="{line}">{native_language}</div></td></tr>\n',
+    "off": "<tr><th onclick=\"playAudio('{audio_html_path}')\">{speaker}</th><td>{target_language}</td></tr>\n",
+}
+
+# Parquet type of each column that isn't text. The schema is fixed up front, as a batch where a column is always empty (e.g. no audio) would otherwise get a different type.
+PARQUET_COLUMN_TYPES = {"audio_duration": pa.float64()}
+
+# Most extraction processes that Windows can wait on at once
+MAX_WINDOWS_WORKERS = 61
+
+# Number of scenes per extraction process that are submitted ahead of the one being consumed
+EXTRACTION_WINDOW_PER_WORKER = 4
+
+# Number of rendered rows that are joined together before being written to the html file
+CONTENT_CHUNK_ROWS = 1000
+
+# (file name suffix, toggle_nl, quests_only) for each version of the html transcript
+HTML_VARIANTS = [
+    ("QuestsOnly", "toggle", True),
+    ("Toggles", "toggle", False),
+    ("AlwaysShowNative", "shown", False),
+    ("NoNL", "off", False),
+]
+
+# Split templates keyed by file name, along with the size and modification time of the file when it was split
+template_cache = {}
 
 
 def main() -> None:
     """
     Loops through directory, extracts subtitles from all .core files and saves it to a spreadsheet
     """
+    parser = argparse.ArgumentParser(
+        description="Extract the subtitles from the game files and build the transcript"
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Compare how quickly the html rows are rendered row by row and column by column on a made up transcript, instead of building the transcript",
+    )
+    parser.add_argument(
+        "--rows",
+        type=int,
+        default=500000,
+        help="Number of lines in the made up transcript when benchmarking",
+    )
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_html(args.rows)
+        return
 
     # Set file paths
     unpacked_root = settings.UNPACKED_ROOT
@@ -34,43 +137,100 @@ def main() -> None:
         _game_root=unpacked_root, _decima_version=settings.DECIMA_VERSION
     )
 
-    # Loop through directories and extract subtitles
-    subtitle_list = []
-    for dirpath, dirnames, filenames in os.walk(sentences_root):
+    # Find every scene
+    scene_list = find_scenes(sentences_root)
 
-        for filename in filenames:
-            if filename == "sentences.core":
-                abs_path = os.path.join(dirpath, filename)
-                rel_path = os.path.relpath(
-                    os.path.join(dirpath, filename), sentences_root
-                )
-                subdirs = rel_path.split("\\")
-                chapter = subdirs[0]
-                scene = subdirs[1]
+    # Streaming builds pass each scene straight to the outputs rather than collecting every line first
+    if settings.STREAMING_BUILD:
+        stream_transcript(scene_list, unpacked_root)
+        print("Done! You can now move on to the next command.")
+        return
 
-                print("Extracting scene " + abs_path)
-                scene_subtitles = extract_subtitles(
-                    abs_path,
-                    chapter,
-                    scene,
-                    settings.NATIVE_LANG,
-                    settings.TARGET_LANG,
-                    settings.INCLUDE_AUDIO,
-                    settings.CONVERTER_PATH,
-                    settings.OUTPUT_FOLDER,
-                    settings.UNPACKED_ROOT,
-                    settings.CHAPTER_IDENTIFIERS,
-                    settings.SCENE_IDENTIFIERS,
-                    settings.DEFAULT_CATEGORY,
-                )
-                if not scene_subtitles is None:
-                    subtitle_list.extend(scene_subtitles)
+    # Work out which scenes have changed since the last run
+    manifest_language = (
+        "AllLanguages" if settings.EXTRACT_ALL_LANGUAGES else settings.TARGET_LANG.name
+    )
+    manifest_path = os.path.join(
+        settings.CACHE_FOLDER,
+        f"{settings.DECIMA_VERSION}_{manifest_language}_Manifest.json",
+    )
+    extraction_options = get_extraction_options()
+
+    if settings.INCREMENTAL_BUILD:
+        manifest = load_manifest(manifest_path, extraction_options)
+    else:
+        manifest = create_manifest(extraction_options)
+
+    stale_scenes = find_stale_scenes(scene_list, manifest, sentences_root)
+    print(
+        f"{len(stale_scenes)} of {len(scene_list)} scenes need extracting, reusing the rest from the manifest"
+    )
+
+    # Extract the subtitles for the scenes that have changed, in parallel if enabled in settings.
+    # Scenes are extracted in category order so that the audio for the quests is converted first. Their records are still merged in the original order.
+    stale_scenes = sort_scenes(
+        stale_scenes,
+        settings.CHAPTER_IDENTIFIERS,
+        settings.SCENE_IDENTIFIERS,
+        settings.DEFAULT_CATEGORY,
+    )
+    audio_converter = create_audio_converter()
+    stale_results = extract_scenes(
+        stale_scenes,
+        settings.EXTRACTION_WORKERS,
+        unpacked_root,
+        settings.DECIMA_VERSION,
+        audio_converter,
+    )
+    update_manifest(manifest, scene_list, stale_scenes, stale_results, sentences_root)
+    queue_unchanged_audio(
+        audio_converter,
+        manifest,
+        scene_list,
+        stale_scenes,
+        sentences_root,
+        get_audio_extension(settings.AUDIO_PRESET),
+    )
+
+    if settings.INCREMENTAL_BUILD:
+        save_manifest(manifest_path, manifest)
+
+    # Merge the scenes back together in the order that they were found
+    subtitle_list = []
+    for abs_path, chapter, scene in scene_list:
+        scene_key = get_scene_key(abs_path, sentences_root)
+        subtitle_list.extend(manifest["scenes"][scene_key]["records"])
+
+    # The manifest keeps every language, pick out the languages from settings
+    if settings.EXTRACT_ALL_LANGUAGES:
+        subtitle_list = select_language_pair(
+            subtitle_list, settings.NATIVE_LANG, settings.TARGET_LANG
+        )
 
     # Convert to dataframe for easy manipulation and sort
     df = pd.DataFrame(subtitle_list)
     df = df.sort_values(by=["category", "chapter", "scene", "line"])
 
-    # Output the data
+    # Output the data. The parquet file is what 04_Create_Anki_Deck.py reads, the spreadsheet is for people
+    print("Writing corpus")
+    write_parquet(
+        df,
+        os.path.join(
+            settings.OUTPUT_FOLDER,
+            f"{settings.DECIMA_VERSION}_{settings.TARGET_LANG.name}_Subtitles.parquet",
+        ),
+    )
+
+    if settings.WRITE_CORPUS_DB:
+        write_corpus_db(
+            df.to_dict("records"),
+            get_corpus_db_path(
+                settings.OUTPUT_FOLDER,
+                settings.DECIMA_VERSION,
+                settings.TARGET_LANG.name,
+            ),
+        )
+
     print("Writing spreadsheet")
     write_excel(
         df,
@@ -84,42 +244,852 @@ def main() -> None:
     print("Writing html")
     write_html(
         df,
-        f"{settings.DECIMA_VERSION}_{settings.TARGET_LANG.name}_QuestsOnly.html",
+        get_html_variants(settings.TRANSCRIPT_VARIANTS),
+        os.path.join(
+            settings.OUTPUT_FOLDER,
+            f"{settings.DECIMA_VERSION}_{settings.TARGET_LANG.name}",
+        ),
         settings.HTML_TEMPLATE_PATH,
         settings.TARGET_LANG.name,
-        settings.OUTPUT_FOLDER,
-        toggle_nl="toggle",
-        quests_only=True,
+        audio_extension=get_audio_extension(settings.AUDIO_PRESET),
+        audio_root=get_audio_root(),
     )
-    write_html(
-        df,
-        f"{settings.DECIMA_VERSION}_{settings.TARGET_LANG.name}_Toggles.html",
-        settings.HTML_TEMPLATE_PATH,
-        settings.TARGET_LANG.name,
-        settings.OUTPUT_FOLDER,
-        toggle_nl="toggle",
-        quests_only=False,
+
+    # The audio carries on converting while the outputs are written
+    finish_audio_conversion(audio_converter)
+
+    print("Done! You can now move on to the next command.")
+
+
+def find_scenes(sentences_root: str) -> list:
+    """
+    Walks the sentences directory and returns a (path, chapter, scene) tuple for every sentences.core file.
+    The order of the list is the order that the scenes are merged in, regardless of how they are extracted.
+    """
+    scene_list = []
+    for dirpath, dirnames, filenames in os.walk(sentences_root):
+
+        for filename in filenames:
+            if filename == "sentences.core":
+                abs_path = os.path.join(dirpath, filename)
+                rel_path = os.path.relpath(
+                    os.path.join(dirpath, filename), sentences_root
+                )
+                subdirs = rel_path.split(os.sep)
+                chapter = subdirs[0]
+                scene = subdirs[1]
+
+                scene_list.append((abs_path, chapter, scene))
+
+    return scene_list
+
+
+def extract_scenes(
+    scene_list: list,
+    workers: int,
+    unpacked_root: str,
+    decima_version: str,
+    audio_converter: AudioConverter = None,
+) -> list:
+    """
+    Extracts the subtitles for every scene in scene_list and returns the result of add_scene_result for each scene.
+    workers = 1 extracts them one at a time, workers = 0 uses a process for every core.
+    Results are always returned in the order of scene_list so the output matches a serial run.
+    """
+    reference_stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+    scene_results = list(
+        iterate_scenes(
+            scene_list,
+            workers,
+            unpacked_root,
+            decima_version,
+            reference_stats,
+            audio_converter,
+        )
     )
-    write_html(
-        df,
-        f"{settings.DECIMA_VERSION}_{settings.TARGET_LANG.name}_AlwaysShowNative.html",
-        settings.HTML_TEMPLATE_PATH,
-        settings.TARGET_LANG.name,
-        settings.OUTPUT_FOLDER,
-        toggle_nl="shown",
-        quests_only=False,
+    print_reference_stats(reference_stats)
+
+    return scene_results
+
+
+def iterate_scenes(
+    scene_list: list,
+    workers: int,
+    unpacked_root: str,
+    decima_version: str,
+    reference_stats: dict,
+    audio_converter: AudioConverter = None,
+):
+    """
+    Generator that yields the result of add_scene_result for each scene in the order of scene_list, extracting them in parallel if workers != 1.
+    reference_stats is updated as each scene is yielded.
+    """
+    if workers == 0:
+        workers = os.cpu_count() or 1
+
+    # ProcessPoolExecutor raises a ValueError on Windows if it is given more than this
+    if os.name == "nt":
+        workers = min(workers, MAX_WINDOWS_WORKERS)
+
+    if workers == 1 or len(scene_list) <= 1:
+        for scene_info in scene_list:
+            yield add_scene_result(
+                extract_scene(scene_info), reference_stats, audio_converter
+            )
+    else:
+        print(f"Extracting {len(scene_list)} scenes using {workers} processes")
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_extraction_worker,
+            initargs=(unpacked_root, decima_version),
+        ) as executor:
+            # Only a few scenes per worker are in flight at once, so finished scenes can't pile up if the caller is slower than the workers.
+            # Results are taken in submission order, not completion order.
+            scene_iterator = iter(scene_list)
+            pending_futures = collections.deque(
+                executor.submit(extract_scene, scene_info)
+                for scene_info in itertools.islice(
+                    scene_iterator, workers * EXTRACTION_WINDOW_PER_WORKER
+                )
+            )
+            while len(pending_futures) > 0:
+                scene_result = pending_futures.popleft().result()
+
+                scene_info = next(scene_iterator, None)
+                if scene_info is not None:
+                    pending_futures.append(executor.submit(extract_scene, scene_info))
+
+                yield add_scene_result(scene_result, reference_stats, audio_converter)
+
+
+def add_scene_result(
+    scene_result: tuple, reference_stats: dict, audio_converter: AudioConverter
+) -> dict:
+    """
+    Each worker has its own reference cache, so add up how much each of them saved.
+    The scene's audio is queued for conversion while the next scenes are extracted.
+    Returns the scene's records (an empty list if it has no subtitles), its audio jobs, the voice files its speaker names came from and the audio files it looked for.
+    """
+    (
+        scene_subtitles,
+        scene_reference_stats,
+        audio_jobs,
+        voice_file_stats,
+        audio_file_stats,
+    ) = scene_result
+
+    for key in reference_stats.keys():
+        reference_stats[key] += scene_reference_stats[key]
+
+    if audio_converter is not None:
+        for at9_path, mp3_path, category in audio_jobs:
+            audio_converter.submit(at9_path, mp3_path, category)
+
+    scene_record = {
+        "records": scene_subtitles if scene_subtitles is not None else [],
+        "audio_jobs": audio_jobs,
+        "voice_file_stats": voice_file_stats,
+        "audio_file_stats": audio_file_stats,
+    }
+
+    return scene_record
+
+
+def print_reference_stats(reference_stats: dict) -> None:
+    print(
+        f"Reference cache: {reference_stats['hits']} hits in memory, {reference_stats['disk_hits']} hits on disk, {reference_stats['misses']} misses"
     )
-    write_html(
-        df,
-        f"{settings.DECIMA_VERSION}_{settings.TARGET_LANG.name}_NoNL.html",
-        settings.HTML_TEMPLATE_PATH,
-        settings.TARGET_LANG.name,
+
+
+def sort_scenes(
+    scene_list: list,
+    chapter_identifiers: dict,
+    scene_identifiers: dict,
+    default_category: str,
+) -> list:
+    """
+    Sorts scenes by category, chapter and scene.
+    Each scene only has one category, so sorting the scenes and then the lines within each scene gives the same order as sorting every line.
+    """
+    sorted_scenes = sorted(
+        scene_list,
+        key=lambda scene_info: (
+            categorise_chapters(
+                scene_info[1],
+                scene_info[2],
+                chapter_identifiers,
+                scene_identifiers,
+                default_category,
+            ),
+            scene_info[1],
+            scene_info[2],
+        ),
+    )
+
+    return sorted_scenes
+
+
+def stream_transcript(scene_list: list, unpacked_root: str) -> None:
+    """
+    Extracts each scene in sorted order and passes its lines to the output sinks one at a time, so memory use doesn't grow with the number of scenes.
+    The manifest isn't used as it would hold every line in memory. Scenes are still read from the scene cache.
+    """
+    sinks = create_sinks(
+        settings.STREAMING_SINKS,
         settings.OUTPUT_FOLDER,
-        toggle_nl="off",
-        quests_only=False,
+        settings.DECIMA_VERSION,
+        settings.TARGET_LANG.name,
+        settings.HTML_TEMPLATE_PATH,
+        get_audio_extension(settings.AUDIO_PRESET),
+        get_audio_root(),
+        get_html_variants(settings.TRANSCRIPT_VARIANTS),
     )
 
-    print("Done! You can now move on to the next command.")
+    sorted_scenes = sort_scenes(
+        scene_list,
+        settings.CHAPTER_IDENTIFIERS,
+        settings.SCENE_IDENTIFIERS,
+        settings.DEFAULT_CATEGORY,
+    )
+
+    audio_converter = create_audio_converter()
+    reference_stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+    for scene_record in iterate_scenes(
+        sorted_scenes,
+        settings.EXTRACTION_WORKERS,
+        unpacked_root,
+        settings.DECIMA_VERSION,
+        reference_stats,
+        audio_converter,
+    ):
+        scene_subtitles = scene_record["records"]
+
+        # Stable sort, same as sorting the whole dataframe
+        scene_subtitles.sort(key=lambda line_dict: line_dict["line"])
+
+        if settings.EXTRACT_ALL_LANGUAGES:
+            scene_subtitles = select_language_pair(
+                scene_subtitles, settings.NATIVE_LANG, settings.TARGET_LANG
+            )
+
+        for line_dict in scene_subtitles:
+            for sink in sinks:
+                sink.write(line_dict)
+
+    print_reference_stats(reference_stats)
+
+    for sink in sinks:
+        sink.close()
+
+    finish_audio_conversion(audio_converter)
+
+
+def create_audio_converter() -> AudioConverter:
+    """
+    Returns None if audio is disabled in settings, or if audio_server.py converts it on demand instead.
+    Incremental builds keep a ledger of the converted audio so that files that are already up to date are skipped.
+    Jobs left over from a run that was stopped part way through are queued first.
+    """
+    if not convert_audio_up_front():
+        return None
+
+    backend = create_audio_backend(
+        settings.AUDIO_BACKEND, settings.CONVERTER_PATH, settings.AUDIO_PRESET
+    )
+    audio_converter = AudioConverter(
+        backend,
+        settings.AUDIO_WORKERS,
+        get_audio_ledger_path(),
+        os.path.join(settings.CACHE_FOLDER, AUDIO_JOURNAL_FILENAME),
+        queue_only=settings.AUDIO_IN_BACKGROUND,
+    )
+    audio_converter.resume()
+
+    return audio_converter
+
+
+def convert_audio_up_front() -> bool:
+    return settings.INCLUDE_AUDIO and not settings.AUDIO_SERVER
+
+
+def get_audio_root() -> str:
+    """
+    Start of the audio links in the html. They point at audio_server.py when it is converting the audio on demand.
+    """
+    if settings.INCLUDE_AUDIO and settings.AUDIO_SERVER:
+        return get_audio_server_url(settings.AUDIO_SERVER_PORT) + "/audio"
+
+    return "audio"
+
+
+def get_audio_ledger_path() -> str:
+    if not settings.INCREMENTAL_BUILD:
+        return None
+
+    return os.path.join(settings.CACHE_FOLDER, AUDIO_LEDGER_FILENAME)
+
+
+def finish_audio_conversion(audio_converter: AudioConverter) -> None:
+    """
+    Either waits for the audio to finish or hands the journal over to a background process, depending on AUDIO_IN_BACKGROUND
+    """
+    if audio_converter is None:
+        return
+
+    if not settings.AUDIO_IN_BACKGROUND:
+        print("Waiting for audio conversion to finish")
+        audio_converter.close()
+
+        # Another conversion was using the journal, so the jobs were handed off to be converted once it has finished
+        if len(audio_converter.handoff_jobs) > 0:
+            convert_journal(
+                settings.AUDIO_BACKEND,
+                settings.AUDIO_PRESET,
+                settings.CONVERTER_PATH,
+                settings.AUDIO_WORKERS,
+                os.path.join(settings.CACHE_FOLDER, AUDIO_JOURNAL_FILENAME),
+                get_audio_ledger_path(),
+            )
+        return
+
+    audio_converter.close()
+    start_background_conversion(
+        settings.AUDIO_BACKEND,
+        settings.AUDIO_PRESET,
+        settings.CONVERTER_PATH,
+        settings.AUDIO_WORKERS,
+        os.path.join(settings.CACHE_FOLDER, AUDIO_JOURNAL_FILENAME),
+        get_audio_ledger_path(),
+        os.path.join(settings.CACHE_FOLDER, AUDIO_LOG_FILENAME),
+    )
+
+
+def create_sinks(
+    sink_names: list,
+    output_folder: str,
+    game_name: str,
+    target_language_name: str,
+    template_filename: str,
+    audio_extension: str = "mp3",
+    audio_root: str = "audio",
+    html_variants: list = HTML_VARIANTS,
+) -> list:
+    """
+    Creates the output sinks for a streaming build. Valid names are xlsx, parquet, sqlite, csv, jsonl and html.
+    html creates a sink for each of the transcript variants in html_variants.
+    """
+    file_prefix = os.path.join(output_folder, f"{game_name}_{target_language_name}")
+
+    sinks = []
+    for sink_name in sink_names:
+        if sink_name == "xlsx":
+            sinks.append(ExcelSink(file_prefix + "_Subtitles.xlsx"))
+        elif sink_name == "parquet":
+            sinks.append(ParquetSink(file_prefix + "_Subtitles.parquet"))
+        elif sink_name == "sqlite":
+            sinks.append(
+                SqliteSink(
+                    get_corpus_db_path(output_folder, game_name, target_language_name)
+                )
+            )
+        elif sink_name == "csv":
+            sinks.append(CsvSink(file_prefix + "_Subtitles.csv"))
+        elif sink_name == "jsonl":
+            sinks.append(JsonlSink(file_prefix + "_Subtitles.jsonl"))
+        elif sink_name == "html":
+            for variant_name, toggle_nl, quests_only in html_variants:
+                sinks.append(
+                    HtmlSink(
+                        file_prefix + f"_{variant_name}.html",
+                        template_filename,
+                        target_language_name,
+                        toggle_nl,
+                        quests_only,
+                        audio_extension,
+                        audio_root,
+                    )
+                )
+        else:
+            print(f"Unknown output {sink_name}, skipping")
+
+    return sinks
+
+
+class JsonlSink:
+    """
+    Writes one json object per line
+    """
+
+    def __init__(self, filename: str) -> None:
+        print("Writing file: " + filename)
+        make_dir(filename)
+        self.file = open(filename, "w", encoding="utf-8")
+
+    def write(self, line_dict: dict) -> None:
+        self.file.write(json.dumps(line_dict, ensure_ascii=False) + "\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class CsvSink:
+    """
+    Writes a csv file, taking the column names from the first line
+    """
+
+    def __init__(self, filename: str) -> None:
+        print("Writing file: " + filename)
+        make_dir(filename)
+        self.file = open(filename, "w", encoding="utf-8", newline="")
+        self.writer = None
+
+    def write(self, line_dict: dict) -> None:
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames=list(line_dict.keys()))
+            self.writer.writeheader()
+
+        self.writer.writerow(line_dict)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ExcelSink:
+    """
+    Writes a spreadsheet row by row using openpyxl's write only mode, taking the column names from the first line
+    """
+
+    def __init__(self, filename: str) -> None:
+        print("Writing file: " + filename)
+        make_dir(filename)
+        self.filename = filename
+        self.workbook = Workbook(write_only=True)
+        self.worksheet = self.workbook.create_sheet("Sheet1")
+        self.columns = None
+
+    def write(self, line_dict: dict) -> None:
+        if self.columns is None:
+            self.columns = list(line_dict.keys())
+            self.worksheet.append(self.columns)
+
+        self.worksheet.append([line_dict[column] for column in self.columns])
+
+    def close(self) -> None:
+        self.workbook.save(self.filename)
+
+
+class ParquetSink:
+    """
+    Writes a parquet file in row groups, so only one batch of lines is held in memory at a time
+    """
+
+    def __init__(self, filename: str, batch_size: int = 50000) -> None:
+        print("Writing file: " + filename)
+        make_dir(filename)
+        self.filename = filename
+        self.batch_size = batch_size
+        self.batch = []
+        self.schema = None
+        self.writer = None
+
+    def write(self, line_dict: dict) -> None:
+        self.batch.append(line_dict)
+
+        if len(self.batch) >= self.batch_size:
+            self.write_batch()
+
+    def write_batch(self) -> None:
+        if len(self.batch) == 0:
+            return
+
+        if self.writer is None:
+            self.schema = get_parquet_schema(self.batch[0].keys())
+            self.writer = pq.ParquetWriter(self.filename, self.schema)
+
+        table = pa.Table.from_pylist(self.batch, schema=self.schema)
+
+        self.writer.write_table(table)
+        self.batch = []
+
+    def close(self) -> None:
+        self.write_batch()
+
+        if self.writer is not None:
+            self.writer.close()
+
+
+def get_parquet_schema(column_names: list) -> pa.Schema:
+    schema = pa.schema(
+        [
+            (column_name, PARQUET_COLUMN_TYPES.get(column_name, pa.string()))
+            for column_name in column_names
+        ]
+    )
+
+    return schema
+
+
+class SqliteSink:
+    """
+    Writes the corpus database in batches. The full text index is built once all lines have been inserted.
+    """
+
+    def __init__(self, filename: str, batch_size: int = 10000) -> None:
+        print("Writing file: " + filename)
+        self.connection = create_corpus_db(filename)
+        self.batch_size = batch_size
+        self.batch = []
+
+    def write(self, line_dict: dict) -> None:
+        self.batch.append(line_dict)
+
+        if len(self.batch) >= self.batch_size:
+            insert_lines(self.connection, self.batch)
+            self.batch = []
+
+    def close(self) -> None:
+        insert_lines(self.connection, self.batch)
+        self.batch = []
+        finish_corpus_db(self.connection)
+
+
+class HtmlSink:
+    """
+    Writes one variant of the html transcript.
+    Rows are rendered into a temporary file as they arrive, as the table of contents has to be written before them.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        template_filename: str,
+        target_language_name: str,
+        toggle_nl: str,
+        quests_only: bool,
+        audio_extension: str = "mp3",
+        audio_root: str = "audio",
+    ) -> None:
+        print("Writing file: " + filename)
+        make_dir(filename)
+        self.filename = filename
+        self.template_filename = template_filename
+        self.target_language_name = target_language_name
+        self.toggle_nl = toggle_nl
+        self.quests_only = quests_only
+        self.audio_extension = audio_extension
+        self.audio_root = audio_root
+        self.toc_entries = {}
+        self.content_state = create_content_state()
+        self.content_file = tempfile.TemporaryFile("w+", encoding="utf-8")
+
+    def write(self, line_dict: dict) -> None:
+        add_toc_entry(
+            self.toc_entries,
+            line_dict["category"],
+            line_dict["chapter"],
+            line_dict.get("audio_duration"),
+        )
+
+        self.content_file.write(
+            render_content_row(
+                self.content_state,
+                line_dict,
+                self.target_language_name,
+                self.toggle_nl,
+                self.quests_only,
+                self.audio_extension,
+                self.audio_root,
+            )
+        )
+
+    def close(self) -> None:
+        self.content_file.write(CONTENT_END_HTML)
+        self.content_file.seek(0)
+
+        slots = {
+            TOC_PLACEHOLDER: render_toc_html(self.toc_entries, self.quests_only),
+            INSTRUCTIONS_PLACEHOLDER: process_instructions_html(self.toggle_nl),
+            CONTENT_PLACEHOLDER: self.content_file,
+        }
+        write_template_html(self.filename, self.template_filename, slots)
+
+        self.content_file.close()
+
+
+def get_extraction_options() -> dict:
+    """
+    The settings that change the records produced by extract_subtitles. The manifest is thrown away if any of them change.
+    """
+    extraction_options = {
+        "manifest_version": MANIFEST_VERSION,
+        "scene_cache_version": SCENE_CACHE_VERSION,
+        "decima_version": settings.DECIMA_VERSION,
+        "all_languages": settings.EXTRACT_ALL_LANGUAGES,
+        "native_lang": settings.NATIVE_LANG.name,
+        "target_lang": settings.TARGET_LANG.name,
+        "include_audio": convert_audio_up_front(),
+        "scan_audio": settings.INCLUDE_AUDIO,
+        "output_folder": settings.OUTPUT_FOLDER,
+        "audio_from_stream": settings.AUDIO_FROM_STREAM,
+        "chapter_identifiers": settings.CHAPTER_IDENTIFIERS,
+        "scene_identifiers": settings.SCENE_IDENTIFIERS,
+        "default_category": settings.DEFAULT_CATEGORY,
+    }
+
+    # The audio jobs stored for each scene include the path of the converted file
+    if not convert_audio_up_front():
+        del extraction_options["output_folder"]
+
+    # The audio durations are read from wherever the audio comes from
+    if not settings.INCLUDE_AUDIO:
+        del extraction_options["audio_from_stream"]
+
+    # Records hold every language, so the language pair only matters if the target language's audio is being used
+    if settings.EXTRACT_ALL_LANGUAGES:
+        del extraction_options["native_lang"]
+
+        if not settings.INCLUDE_AUDIO:
+            del extraction_options["target_lang"]
+
+    return extraction_options
+
+
+def create_manifest(extraction_options: dict) -> dict:
+    manifest = {"options": extraction_options, "scenes": {}}
+
+    return manifest
+
+
+def load_manifest(manifest_path: str, extraction_options: dict) -> dict:
+    """
+    Loads the manifest from the previous run. Starts a new one if it is missing, unreadable or was built with different settings.
+    """
+    if not file_exists(manifest_path):
+        return create_manifest(extraction_options)
+
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        print(f"Could not read {manifest_path}, rebuilding every scene")
+        return create_manifest(extraction_options)
+
+    if manifest.get("options") != extraction_options:
+        print("Settings have changed since the last run, rebuilding every scene")
+        return create_manifest(extraction_options)
+
+    return manifest
+
+
+def save_manifest(manifest_path: str, manifest: dict) -> None:
+    write_json(manifest_path, manifest, ensure_ascii=False)
+
+
+def get_scene_key(abs_path: str, sentences_root: str) -> str:
+    scene_key = os.path.relpath(abs_path, sentences_root).replace("\\", "/")
+
+    return scene_key
+
+
+def find_stale_scenes(scene_list: list, manifest: dict, sentences_root: str) -> list:
+    """
+    Returns the scenes that have been added or changed since the manifest was written, or whose speaker names came from voice files that have changed,
+    or whose audio files have been added, changed or removed (so lines that had no playable audio pick it up once it has been dumped again).
+    Size and modification time are checked first. The file is only hashed if they differ, so that touched but unchanged files are still reused.
+    """
+    # Voice files are shared by many scenes, so each one is only checked once
+    voice_file_stats = {}
+
+    stale_scenes = []
+    for scene_info in scene_list:
+        abs_path = scene_info[0]
+        entry = manifest["scenes"].get(get_scene_key(abs_path, sentences_root))
+
+        if entry is None:
+            stale_scenes.append(scene_info)
+            continue
+
+        if not are_voice_files_current(entry["voice_file_stats"], voice_file_stats):
+            stale_scenes.append(scene_info)
+            continue
+
+        if not are_audio_files_current(entry["audio_file_stats"]):
+            stale_scenes.append(scene_info)
+            continue
+
+        file_stat = os.stat(abs_path)
+        if (
+            entry["size"] == file_stat.st_size
+            and entry["mtime"] == file_stat.st_mtime_ns
+        ):
+            continue
+
+        if entry["size"] == file_stat.st_size and entry["hash"] == hash_file(abs_path):
+            entry["mtime"] = file_stat.st_mtime_ns
+            continue
+
+        stale_scenes.append(scene_info)
+
+    return stale_scenes
+
+
+def are_voice_files_current(
+    entry_voice_file_stats: dict, voice_file_stats: dict
+) -> bool:
+    """
+    Compares the voice files recorded in a manifest entry with the ones on disk. voice_file_stats keeps the stats that have already been read.
+    """
+    for voice_path, file_stat in entry_voice_file_stats.items():
+        if voice_path not in voice_file_stats:
+            voice_file_stats[voice_path] = get_reference_file_stat(voice_path)
+
+        if voice_file_stats[voice_path] != file_stat:
+            return False
+
+    return True
+
+
+def are_audio_files_current(entry_audio_file_stats: dict) -> bool:
+    for audio_path, file_stat in entry_audio_file_stats.items():
+        if get_file_stat(audio_path) != file_stat:
+            return False
+
+    return True
+
+
+def update_manifest(
+    manifest: dict,
+    scene_list: list,
+    stale_scenes: list,
+    stale_results: list,
+    sentences_root: str,
+) -> None:
+    """
+    Stores the newly extracted records and audio jobs and drops the scenes that no longer exist
+    """
+    for scene_info, scene_record in zip(stale_scenes, stale_results):
+        abs_path = scene_info[0]
+        file_stat = os.stat(abs_path)
+
+        manifest["scenes"][get_scene_key(abs_path, sentences_root)] = {
+            "path": abs_path,
+            "size": file_stat.st_size,
+            "mtime": file_stat.st_mtime_ns,
+            "hash": hash_file(abs_path),
+            "records": scene_record["records"],
+            "audio_jobs": scene_record["audio_jobs"],
+            "voice_file_stats": scene_record["voice_file_stats"],
+            "audio_file_stats": scene_record["audio_file_stats"],
+        }
+
+    current_keys = {
+        get_scene_key(scene_info[0], sentences_root) for scene_info in scene_list
+    }
+    for scene_key in list(manifest["scenes"].keys()):
+        if scene_key not in current_keys:
+            print(f"Scene {scene_key} has been removed, dropping it from the manifest")
+            del manifest["scenes"][scene_key]
+
+
+def queue_unchanged_audio(
+    audio_converter: AudioConverter,
+    manifest: dict,
+    scene_list: list,
+    stale_scenes: list,
+    sentences_root: str,
+    audio_extension: str,
+) -> None:
+    """
+    Queues the stored audio jobs of every scene that wasn't extracted again, so that the ledger can convert any files that are missing or out of date.
+    The jobs keep the file extension of the preset they were stored with, so it is swapped for the current one.
+    """
+    if audio_converter is None:
+        return
+
+    stale_keys = {
+        get_scene_key(scene_info[0], sentences_root) for scene_info in stale_scenes
+    }
+    unchanged_scenes = [
+        scene_info
+        for scene_info in scene_list
+        if get_scene_key(scene_info[0], sentences_root) not in stale_keys
+    ]
+    unchanged_scenes = sort_scenes(
+        unchanged_scenes,
+        settings.CHAPTER_IDENTIFIERS,
+        settings.SCENE_IDENTIFIERS,
+        settings.DEFAULT_CATEGORY,
+    )
+
+    for abs_path, chapter, scene in unchanged_scenes:
+        entry = manifest["scenes"][get_scene_key(abs_path, sentences_root)]
+        for audio_source, audio_path, category in entry["audio_jobs"]:
+            audio_converter.submit(
+                audio_source,
+                os.path.splitext(audio_path)[0] + "." + audio_extension,
+                category,
+            )
+
+
+def init_extraction_worker(unpacked_root: str, decima_version: str) -> None:
+    """
+    pydecima keeps the game root in module globals, so each worker process needs to set them again
+    """
+    pydecima.reader.set_globals(
+        _game_root=unpacked_root, _decima_version=decima_version
+    )
+
+
+def extract_scene(scene_info: tuple) -> tuple:
+    """
+    Wrapper around extract_subtitles that takes a single (path, chapter, scene) tuple so it can be used with map.
+    Also returns how the reference cache was used for this scene, as worker processes can't update the main process' counters,
+    and the audio files to convert, which are handed to the main process' AudioConverter,
+    and the voice files that the speaker names came from and the audio files that were looked for, so the manifest can tell when they change.
+    """
+    abs_path, chapter, scene = scene_info
+    stats_before = get_reference_stats()
+    audio_jobs = []
+    voice_file_stats = {}
+    audio_file_stats = {}
+
+    print("Extracting scene " + abs_path)
+    scene_subtitles = list(
+        extract_subtitles(
+            file_path=abs_path,
+            chapter=chapter,
+            scene=scene,
+            native_lang=settings.NATIVE_LANG,
+            target_lang=settings.TARGET_LANG,
+            include_audio=convert_audio_up_front(),
+            output_folder=settings.OUTPUT_FOLDER,
+            unpacked_root=settings.UNPACKED_ROOT,
+            chapter_categories=settings.CHAPTER_IDENTIFIERS,
+            scene_categories=settings.SCENE_IDENTIFIERS,
+            default_category=settings.DEFAULT_CATEGORY,
+            cache_folder=settings.CACHE_FOLDER,
+            all_languages=settings.EXTRACT_ALL_LANGUAGES,
+            audio_jobs=audio_jobs,
+            audio_preset=settings.AUDIO_PRESET,
+            audio_from_stream=settings.AUDIO_FROM_STREAM,
+            scan_audio=settings.INCLUDE_AUDIO,
+            voice_file_stats=voice_file_stats,
+            audio_file_stats=audio_file_stats,
+        )
+    )
+
+    stats_after = get_reference_stats()
+    scene_reference_stats = {
+        key: stats_after[key] - stats_before[key] for key in stats_after.keys()
+    }
+
+    return (
+        scene_subtitles,
+        scene_reference_stats,
+        audio_jobs,
+        voice_file_stats,
+        audio_file_stats,
+    )
 
 
 def extract_subtitles(
@@ -129,74 +1099,241 @@ def extract_subtitles(
     native_lang: ETextLanguages,
     target_lang: ETextLanguages,
     include_audio: bool,
-    converter_path: str,
     output_folder: str,
     unpacked_root: str,
     chapter_categories: dict,
     scene_categories: dict,
     default_category: str,
-) -> list:
+    cache_folder: str,
+    all_languages: bool = False,
+    audio_jobs: list = None,
+    audio_preset: str = "mp3",
+    audio_from_stream: bool = False,
+    scan_audio: bool = False,
+    voice_file_stats: dict = None,
+    audio_file_stats: dict = None,
+):
     """
-    Extracts native and target language subtitles from a Decima Engine .core file
+    Generator that extracts native and target language subtitles from a Decima Engine .core file, one line at a time.
+    If all_languages is set, the text and speaker are stored for every language instead and select_language_pair picks out the pair later.
+    If include_audio is set, the (at9, mp3, category) for each line are added to audio_jobs for an AudioConverter to convert (they are thrown away if audio_jobs isn't given).
+    audio_preset is the name of the preset in audio_converter.AUDIO_PRESETS, which sets the format of the audio files.
+    If audio_from_stream is set, the audio is read straight from the scene's .stream file instead of the .at9 files written by the sentence dumper.
+    If scan_audio is set, the length of each line's audio is read from its header and stored as audio_duration (None if it has no audio).
+    Audio that is empty or cut off is never converted, as its header is always checked before the job is queued.
+    If voice_file_stats is a dict, the size and modification time of each voice file that the speaker names came from are added to it.
+    If audio_file_stats is a dict, the same is added for each audio file that was looked for, with None for the ones that don't exist.
     """
-    scene_dict = {}
-    pydecima.reader.read_objects(file_path, scene_dict)
-
-    scene_subtitles = []
-    for resource in scene_dict.values():
-        if isinstance(resource, SentenceResource):
-            localized_text = resource.text.follow(scene_dict)
-
-            if localized_text is not None:
-
-                # Extract text data
-                nl_sub = clean_brackets(localized_text.language[native_lang])
-                tl_sub = clean_brackets(localized_text.language[target_lang])
-                category = categorise_chapters(
+    if audio_jobs is None:
+        audio_jobs = []
+
+    scene_data = load_scene(file_path, cache_folder)
+    if voice_file_stats is not None:
+        voice_file_stats.update(get_voice_file_stats(scene_data))
+    audio_extension = get_audio_extension(audio_preset)
+
+    speakers = get_speaker_table(scene_data, target_lang)
+    if all_languages:
+        speakers_all = {
+            language: get_speaker_table(scene_data, language)
+            for language in ETextLanguages
+        }
+
+    for sentence in scene_data["sentences"]:
+        localized_text = sentence["text"]
+
+        if localized_text is not None:
+
+            # Extract text data
+            nl_sub = clean_brackets(localized_text[native_lang])
+            tl_sub = clean_brackets(localized_text[target_lang])
+            category = categorise_chapters(
+                chapter,
+                scene,
+                chapter_categories,
+                scene_categories,
+                default_category,
+            )
+            speaker = speakers[sentence["voice"]]
+
+            audio_source = None
+            audio_header = None
+            if include_audio or scan_audio:
+                audio_source = find_sentence_audio_source(
+                    file_path,
+                    unpacked_root,
                     chapter,
                     scene,
-                    chapter_categories,
-                    scene_categories,
-                    default_category,
+                    sentence,
+                    target_lang,
+                    audio_from_stream,
+                    audio_file_stats,
                 )
-                speaker = get_speaker(resource, scene_dict, target_lang)
-
-                if len(tl_sub) > 0:
-                    line_dict = {
-                        "category": category,
-                        "chapter": chapter,
-                        "scene": scene,
-                        "line": resource.name,
-                        "speaker": speaker,
-                        "native_language": nl_sub,
-                        "target_language": tl_sub,
-                    }
-                    scene_subtitles.append(line_dict)
-
-                # Convert the audio if it exists
-                if include_audio:
-                    at9_path = os.path.join(
-                        unpacked_root,
-                        "localized",
-                        "sentences",
-                        chapter,
-                        scene,
-                        "sentences." + target_lang.name.lower(),
-                        resource.name + ".at9",
-                    )
-                    mp3_path = os.path.join(
-                        output_folder,
-                        "audio",
-                        chapter,
-                        scene,
-                        target_lang.name.lower(),
-                        resource.name + ".mp3",
+            if audio_source is not None:
+                audio_header = scan_at9_header(audio_source)
+
+            if all_languages:
+                line_dict = {
+                    "category": category,
+                    "chapter": chapter,
+                    "scene": scene,
+                    "line": sentence["name"],
+                }
+                for language in ETextLanguages:
+                    line_dict[get_speaker_column(language)] = speakers_all[language][
+                        sentence["voice"]
+                    ]
+                    line_dict[get_text_column(language)] = clean_brackets(
+                        localized_text[language]
                     )
+                if scan_audio:
+                    line_dict["audio_duration"] = get_audio_duration(audio_header)
+                yield line_dict
+
+            elif len(tl_sub) > 0:
+                line_dict = {
+                    "category": category,
+                    "chapter": chapter,
+                    "scene": scene,
+                    "line": sentence["name"],
+                    "speaker": speaker,
+                    "native_language": nl_sub,
+                    "target_language": tl_sub,
+                }
+                if scan_audio:
+                    line_dict["audio_duration"] = get_audio_duration(audio_header)
+                yield line_dict
+
+            # Convert the audio if it exists
+            if include_audio:
+                mp3_path = os.path.join(
+                    output_folder,
+                    "audio",
+                    chapter,
+                    scene,
+                    target_lang.name.lower(),
+                    sentence["name"] + "." + audio_extension,
+                )
+
+                if is_audio_playable(audio_header):
+                    audio_jobs.append((audio_source, mp3_path, category))
+
+
+def find_sentence_audio_source(
+    file_path: str,
+    unpacked_root: str,
+    chapter: str,
+    scene: str,
+    sentence: dict,
+    target_lang: ETextLanguages,
+    audio_from_stream: bool,
+    audio_file_stats: dict = None,
+) -> str:
+    """
+    The .at9 file written by the sentence dumper or, if audio_from_stream is set, the slice of the .stream file. None if the line has no audio.
+    If audio_file_stats is a dict, the stat of the file that was looked for is added to it.
+    """
+    if audio_from_stream:
+        return get_sentence_stream_source(
+            file_path, sentence, target_lang, audio_file_stats
+        )
+
+    at9_path = os.path.join(
+        unpacked_root,
+        "localized",
+        "sentences",
+        chapter,
+        scene,
+        "sentences." + target_lang.name.lower(),
+        sentence["name"] + ".at9",
+    )
+    at9_stat = get_file_stat(at9_path)
+    if audio_file_stats is not None:
+        audio_file_stats[at9_path] = at9_stat
+
+    if at9_stat is None:
+        return None
+
+    return at9_path
+
+
+def get_audio_duration(audio_header: dict) -> float:
+    if not is_audio_playable(audio_header):
+        return None
+
+    return round(audio_header["duration"], 3)
+
 
-                    if file_exists(at9_path):
-                        at9_to_mp3(converter_path, at9_path, mp3_path, False)
+def get_sentence_stream_source(
+    file_path: str,
+    sentence: dict,
+    target_lang: ETextLanguages,
+    audio_file_stats: dict = None,
+) -> str:
+    """
+    The part of the scene's .stream file that holds the sentence's ATRAC9 audio, or None if it doesn't have any.
+    The offsets come from the sound info in the scene cache, the same as the sentence dumper uses.
+    """
+    audio_language = get_audio_language(target_lang)
+    sound = sentence["sound"]
+
+    if (
+        audio_language is None
+        or sound is None
+        or sound["audio_type"] not in AT9_AUDIO_TYPES
+        or sound["sound_info"][audio_language] is None
+    ):
+        return None
+
+    stream_path = get_stream_path(os.path.dirname(file_path), audio_language)
+    stream_stat = get_file_stat(stream_path)
+    if audio_file_stats is not None:
+        audio_file_stats[stream_path] = stream_stat
+
+    if stream_stat is None:
+        return None
 
-    return scene_subtitles
+    start, size, sample_count = sound["sound_info"][audio_language]
+
+    return get_stream_source(stream_path, start, size)
+
+
+def get_text_column(language: ETextLanguages) -> str:
+    return "text_" + language.name
+
+
+def get_speaker_column(language: ETextLanguages) -> str:
+    return "speaker_" + language.name
+
+
+def select_language_pair(
+    subtitle_list: list, native_lang: ETextLanguages, target_lang: ETextLanguages
+) -> list:
+    """
+    Converts records extracted with all languages into the same records that a native/target extraction would have produced
+    """
+    native_column = get_text_column(native_lang)
+    target_column = get_text_column(target_lang)
+    speaker_column = get_speaker_column(target_lang)
+
+    pair_list = []
+    for line_dict in subtitle_list:
+        if len(line_dict[target_column]) > 0:
+            pair_dict = {
+                "category": line_dict["category"],
+                "chapter": line_dict["chapter"],
+                "scene": line_dict["scene"],
+                "line": line_dict["line"],
+                "speaker": line_dict[speaker_column],
+                "native_language": line_dict[native_column],
+                "target_language": line_dict[target_column],
+            }
+            # Durations are for the target language that was extracted with, which is part of the extraction options
+            if "audio_duration" in line_dict:
+                pair_dict["audio_duration"] = line_dict["audio_duration"]
+            pair_list.append(pair_dict)
+
+    return pair_list
 
 
 def write_excel(df: pd.DataFrame, filename: str) -> None:
@@ -204,54 +1341,161 @@ def write_excel(df: pd.DataFrame, filename: str) -> None:
     df.to_excel(filename, index=False)
 
 
+def write_parquet(df: pd.DataFrame, filename: str) -> None:
+    print("Writing file: " + filename)
+    df.to_parquet(filename, index=False)
+
+
+def get_html_variants(variant_names: list) -> list:
+    """
+    The entries of HTML_VARIANTS named in variant_names, in their usual order
+    """
+    for variant_name in variant_names:
+        if variant_name not in [html_variant[0] for html_variant in HTML_VARIANTS]:
+            print(f"Unknown transcript variant {variant_name}, skipping")
+
+    return [
+        html_variant
+        for html_variant in HTML_VARIANTS
+        if html_variant[0] in variant_names
+    ]
+
+
 def write_html(
     df: pd.DataFrame,
-    output_filename: str,
+    html_variants: list,
+    file_prefix: str,
     template_filename: str,
     target_language_name: str,
-    output_folder: str,
-    toggle_nl: str,
-    quests_only: bool,
+    audio_extension: str = "mp3",
+    audio_root: str = "audio",
 ) -> None:
+    """
+    Writes [file_prefix]_[variant name].html for each of html_variants.
+    The template is written to every file side by side and the rows are rendered from columns shared by every variant.
+    The rows are written straight into the files in chunks, so the transcript is never held in memory as one string.
+    """
+    transcript_outline = create_transcript_outline(df)
+    toc_entries = create_toc_entries(transcript_outline)
+    template_segments = load_template_segments(template_filename)
 
-    print("Writing file: " + output_filename)
-
-    # Generate Table of Contents data
-    toc = process_toc_html(df, quests_only)
+    files = []
+    try:
+        for variant_name, toggle_nl, quests_only in html_variants:
+            output_filename = f"{file_prefix}_{variant_name}.html"
+            print("Writing file: " + output_filename)
+            files.append(open(output_filename, "w", encoding="utf-8"))
+
+        for segment_type, segment in template_segments:
+            if segment_type == "literal":
+                for file in files:
+                    file.write(segment)
+            elif segment == CONTENT_PLACEHOLDER:
+                write_content_html(
+                    files,
+                    df,
+                    target_language_name,
+                    html_variants,
+                    audio_extension,
+                    audio_root,
+                    transcript_outline,
+                )
+            else:
+                for file, (variant_name, toggle_nl, quests_only) in zip(
+                    files, html_variants
+                ):
+                    file.write(
+                        render_slot_html(segment, toc_entries, toggle_nl, quests_only)
+                    )
+    finally:
+        for file in files:
+            file.close()
 
-    # Generate content data
-    content = process_content_html(df, target_language_name, toggle_nl, quests_only)
 
-    # Generate instructions
-    instructions = process_instructions_html(toggle_nl)
+def render_slot_html(
+    placeholder: str, toc_entries: dict, toggle_nl: str, quests_only: bool
+) -> str:
+    """
+    Content for the template's placeholders, other than the rows themselves
+    """
+    if placeholder == TOC_PLACEHOLDER:
+        return render_toc_html(toc_entries, quests_only)
 
-    # Merge data into template
-    template_text = merge_template_html(template_filename, toc, content, instructions)
+    return process_instructions_html(toggle_nl)
 
-    write_file_html(os.path.join(output_folder, output_filename), template_text)
 
+def write_template_html(
+    output_filename: str, template_filename: str, slots: dict
+) -> None:
+    """
+    Writes the template with each placeholder replaced by the content in slots.
+    A slot can be a string, a file to copy from or a function that writes the content to the output file itself.
+    """
+    template_segments = load_template_segments(template_filename)
 
-def write_file_html(output_filename: str, template_text: str) -> None:
     with open(output_filename, "w", encoding="utf-8") as file:
-        file.write(template_text)
+        for segment_type, segment in template_segments:
+            if segment_type == "literal":
+                file.write(segment)
+            elif isinstance(slots[segment], str):
+                file.write(slots[segment])
+            elif callable(slots[segment]):
+                slots[segment](file)
+            else:
+                shutil.copyfileobj(slots[segment], file)
+
+
+def load_template_segments(template_filename: str) -> list:
+    """
+    The template split by split_template_html. Each template is only read and split once per run,
+    or again if the file has changed since.
+    """
+    file_stat = os.stat(template_filename)
+    template_stat = [file_stat.st_size, file_stat.st_mtime_ns]
 
+    cached_template = template_cache.get(template_filename)
+    if cached_template is not None and cached_template["file_stat"] == template_stat:
+        return cached_template["segments"]
 
-def merge_template_html(
-    template_filename: str, toc: str, content: str, instructions: str
-) -> str:
+    template_segments = split_template_html(read_template_html(template_filename))
+    template_cache[template_filename] = {
+        "file_stat": template_stat,
+        "segments": template_segments,
+    }
 
+    return template_segments
+
+
+def read_template_html(template_filename: str) -> str:
     with open(template_filename, "r") as file:
         template_text = file.read()
 
-    template_text = template_text.replace("{{INSERT_TOC_HERE}}", toc, 1)
-    template_text = template_text.replace("{{INSERT_CONTENT_HERE}}", content, 1)
-    template_text = template_text.replace(
-        "{{INSERT INSTRUCTIONS HERE}}", instructions, 1
-    )
-
     return template_text
 
 
+def split_template_html(template_text: str) -> list:
+    """
+    Splits the template into ("literal", text) and ("slot", placeholder) segments, in the order they appear.
+    Only the first occurrence of each placeholder is a slot, the same as replacing each placeholder once.
+    """
+    slot_positions = []
+    for placeholder in [TOC_PLACEHOLDER, CONTENT_PLACEHOLDER, INSTRUCTIONS_PLACEHOLDER]:
+        position = template_text.find(placeholder)
+        if position != -1:
+            slot_positions.append((position, placeholder))
+
+    template_segments = []
+    previous_end = 0
+    for position, placeholder in sorted(slot_positions):
+        template_segments.append(("literal", template_text[previous_end:position]))
+        template_segments.append(("slot", placeholder))
+        previous_end = position + len(placeholder)
+
+    template_segments.append(("literal", template_text[previous_end:]))
+
+    return template_segments
+
+
 def process_instructions_html(toggle_nl: str) -> str:
     instructions = ""
 
@@ -263,99 +1507,319 @@ def process_instructions_html(toggle_nl: str) -> str:
     return instructions
 
 
-def process_content_html(
-    df: pd.DataFrame, target_language_name: str, toggle_nl: str, quests_only: bool
+def write_content_html(
+    files: list,
+    df: pd.DataFrame,
+    target_language_name: str,
+    html_variants: list,
+    audio_extension: str = "mp3",
+    audio_root: str = "audio",
+    transcript_outline: pd.DataFrame = None,
+) -> None:
+    """
+    Renders the rows of the transcript for every variant in html_variants into the matching file.
+    The audio paths and ids are built once and shared by every variant, then each variant is written in chunks.
+    Pass in transcript_outline if it has already been made from df to save making it again.
+    """
+    if transcript_outline is None:
+        transcript_outline = create_transcript_outline(df)
+
+    row_columns = create_row_columns(
+        df, target_language_name, audio_extension, audio_root
+    )
+
+    for file, (variant_name, toggle_nl, quests_only) in zip(files, html_variants):
+        for content_chunk in render_content_rows(
+            row_columns, transcript_outline, toggle_nl, quests_only
+        ):
+            file.write(content_chunk)
+
+        # Terminate final scene and chapter
+        file.write(CONTENT_END_HTML)
+
+
+def create_content_state() -> dict:
+    """
+    Keeps track of the chapter and scene of the previous row so that render_content_row knows when to start new ones
+    """
+    content_state = {
+        "previous_chapter_code": "[start_of_loop]",
+        "previous_scene": "[start_of_loop]",
+    }
+
+    return content_state
+
+
+def render_content_row(
+    content_state: dict,
+    row: dict,
+    target_language_name: str,
+    toggle_nl: str,
+    quests_only: bool,
+    audio_extension: str = "mp3",
+    audio_root: str = "audio",
 ) -> str:
+    """
+    Renders a single line of the transcript, starting a new chapter and/or scene first if they have changed.
+    row can be anything that supports row["column"], e.g. a dict or a dataframe row.
+    audio_root is where the audio links point, either the audio folder next to the html file or the audio server.
+    """
     content_data = ""
-    previous_chapter_code = "[start_of_loop]"
-    previous_scene = "[start_of_loop]"
+    category = row["category"]
+    chapter = row["chapter"]
+    scene = row["scene"]
+    speaker = row["speaker"]
+    line = row["line"]
+    tl_sub = row["target_language"]
+    nl_sub = row["native_language"]
+    chapter_code = create_chapter_code(category, chapter)
+    audio_html_path = (
+        audio_root
+        + "/"
+        + chapter
+        + "/"
+        + scene
+        + "/"
+        + target_language_name.lower()
+        + "/"
+        + line
+        + "."
+        + audio_extension
+    )
 
-    for index, row in df.iterrows():
-        category = row["category"]
-        chapter = row["chapter"]
-        scene = row["scene"]
-        speaker = row["speaker"]
-        line = row["line"]
-        tl_sub = row["target_language"]
-        nl_sub = row["native_language"]
-        chapter_code = create_chapter_code(category, chapter)
-        audio_html_path = (
-            "audio"
+    # Move on to the next one if we have quests only enabled and the category is not a quest
+    if quests_only:
+        category_code = int(category[0:2])
+
+        if category_code >= 10:
+            return content_data
+
+    # Make line compatible with css, now that we have used the "correct" version with the audio path
+    line = spaces_to_underscores(line.strip())
+
+    # Deal with chapter and categories changing
+    if chapter_code != content_state["previous_chapter_code"]:
+        # End the previous chapter
+        if content_state["previous_chapter_code"] != "[start_of_loop]":
+            content_data += CONTENT_END_HTML
+
+        # Start new chapter
+        content_data += CHAPTER_START_HTML.format(
+            chapter_code=chapter_code, chapter=chapter
+        )
+
+        # Update data for next iteration of loop
+        content_state["previous_chapter_code"] = chapter_code
+
+    # Deal with scene changing
+    if scene != content_state["previous_scene"]:
+        # End the previous scene
+        if content_state["previous_chapter_code"] != "[start_of_loop]":
+            content_data += SCENE_END_HTML
+
+        # Start new scene
+        content_data += SCENE_START_HTML.format(scene=scene)
+
+        # Update data for next iteration of loop
+        content_state["previous_scene"] = scene
+
+    # Add in the current line
+    content_data += ROW_HTML.get(toggle_nl, ROW_HTML["off"]).format(
+        audio_html_path=audio_html_path,
+        speaker=speaker,
+        line=line,
+        target_language=tl_sub,
+        native_language=nl_sub,
+    )
+
+    return content_data
+
+
+def create_row_columns(
+    df: pd.DataFrame,
+    target_language_name: str,
+    audio_extension: str = "mp3",
+    audio_root: str = "audio",
+) -> pd.DataFrame:
+    """
+    Everything render_content_rows needs for each line, built a whole column at a time with pandas string operations.
+    Gives the same line ids and audio paths as render_content_row.
+    """
+    row_columns = pd.DataFrame(
+        {
+            "speaker": df["speaker"],
+            "line": df["line"].str.strip().str.replace(" ", "_", regex=False),
+            "audio_html_path": audio_root
             + "/"
-            + chapter
+            + df["chapter"]
             + "/"
-            + scene
+            + df["scene"]
             + "/"
             + target_language_name.lower()
             + "/"
-            + line
-            + ".mp3"
-        )
+            + df["line"]
+            + "."
+            + audio_extension,
+            "target_language": df["target_language"],
+            "native_language": df["native_language"],
+        }
+    )
 
-        # Move on to the next one if we have quests only enabled and the category is not a quest
-        if quests_only:
-            category_code = int(category[0:2])
+    return row_columns
 
-            if category_code >= 10:
-                continue
 
-        # Make line compatible with css, now that we have used the "correct" version with the audio path
-        line = spaces_to_underscores(line.strip())
+def render_content_rows(
+    row_columns: pd.DataFrame,
+    transcript_outline: pd.DataFrame,
+    toggle_nl: str,
+    quests_only: bool,
+):
+    """
+    Renders every row from create_row_columns, giving the same html as calling render_content_row on each row in turn.
+    Chapters and scenes are started from transcript_outline, so the lines in each run are formatted from plain lists without checking every row.
+    Yields the html in chunks of roughly CONTENT_CHUNK_ROWS rows, without the end of the final scene and chapter.
+    """
+    # Move on to the next one if we have quests only enabled and the category is not a quest
+    if quests_only:
+        transcript_outline = transcript_outline[
+            transcript_outline["category"].str[0:2].astype(int) < 10
+        ]
+
+    row_html = ROW_HTML.get(toggle_nl, ROW_HTML["off"])
+    speakers = row_columns["speaker"].tolist()
+    lines = row_columns["line"].tolist()
+    audio_html_paths = row_columns["audio_html_path"].tolist()
+    tl_subs = row_columns["target_language"].tolist()
+    nl_subs = row_columns["native_language"].tolist()
 
-        # Deal with chapter and categories changing
+    previous_chapter_code = "[start_of_loop]"
+    previous_scene = "[start_of_loop]"
+    content_chunk = []
+    for chapter_code, chapter, scene, start, stop in zip(
+        transcript_outline["chapter_code"].tolist(),
+        transcript_outline["chapter"].tolist(),
+        transcript_outline["scene"].tolist(),
+        transcript_outline["start"].tolist(),
+        transcript_outline["stop"].tolist(),
+    ):
         if chapter_code != previous_chapter_code:
-            # End the previous chapter
             if previous_chapter_code != "[start_of_loop]":
-                content_data += "</tbody></table></div></article></section>\n"
+                content_chunk.append(CONTENT_END_HTML)
 
-            # Start new chapter
-            content_data += f'<section id="{chapter_code}"><div class="row"><h1 class="col">{chapter}</h1></div>\n'
-
-            # Update data for next iteration of loop
+            content_chunk.append(
+                CHAPTER_START_HTML.format(chapter_code=chapter_code, chapter=chapter)
+            )
             previous_chapter_code = chapter_code
 
-        # Deal with scene changing
+        # The first scene is also "ended", the same as render_content_row
         if scene != previous_scene:
-            # End the previous scene
-            if previous_chapter_code != "[start_of_loop]":
-                content_data += "</tbody></table></div></article>\n"
-
-            # Start new scene
-            content_data += f'<article class="row" id="{scene}"><div class="col"><h2 class="fw-lighter text-body-secondary">{scene}</h2><table class="table table-borderless table-sm"><thead><th style="width: 10%"></th><th></th></thead><tbody>\n'
-
-            # Update data for next iteration of loop
+            content_chunk.append(SCENE_END_HTML)
+            content_chunk.append(SCENE_START_HTML.format(scene=scene))
             previous_scene = scene
 
-        # Add in the current line
-        if toggle_nl == "toggle":
-            content_data += (
-                '<tr><th onclick="playAudio('
-                + f"'{audio_html_path}'"
-                + f')">{speaker}</th><td><span data-bs-toggle="collapse" role="button" href="#{line}">{tl_sub}</span><div class="collapse fw-lighter text-body-secondary fst-italic" id="{line}">{nl_sub}</div></td></tr>\n'
+        content_chunk.extend(
+            row_html.format(
+                audio_html_path=audio_html_path,
+                speaker=speaker,
+                line=line,
+                target_language=tl_sub,
+                native_language=nl_sub,
             )
-        elif toggle_nl == "shown":
-            content_data += (
-                '<tr><th onclick="playAudio('
-                + f"'{audio_html_path}'"
-                + f')">{speaker}</th><td><span>{tl_sub}</span><div class="fw-lighter text-body-secondary fst-italic" id="{line}">{nl_sub}</div></td></tr>\n'
+            for speaker, line, audio_html_path, tl_sub, nl_sub in zip(
+                speakers[start:stop],
+                lines[start:stop],
+                audio_html_paths[start:stop],
+                tl_subs[start:stop],
+                nl_subs[start:stop],
             )
-        else:
-            content_data += (
-                '<tr><th onclick="playAudio('
-                + f"'{audio_html_path}'"
-                + f')">{speaker}</th><td>{tl_sub}</td></tr>\n'
+        )
+
+        if len(content_chunk) >= CONTENT_CHUNK_ROWS:
+            yield "".join(content_chunk)
+            content_chunk = []
+
+    yield "".join(content_chunk)
+
+
+def create_transcript_outline(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    One row for each run of consecutive lines from the same chapter and scene, in the order that they appear in df:
+    category, chapter, chapter_code, scene, the positions of the first line and the line after the last (start and stop)
+    and the total length of the run's audio in milliseconds (audio_duration_ms).
+    The boundaries are found for the whole frame at once, so the table of contents and the html rows don't have to rescan it.
+    """
+    chapter_codes = (
+        (df["category"] + "_" + df["chapter"])
+        .str.replace(" ", "_", regex=False)
+        .str.strip()
+    )
+    run_starts = chapter_codes.ne(chapter_codes.shift()) | df["scene"].ne(
+        df["scene"].shift()
+    )
+    start_positions = run_starts.to_numpy().nonzero()[0]
+
+    # Rounded per line, the same as add_toc_entry, so the totals match a streaming build
+    if "audio_duration" in df.columns:
+        audio_durations_ms = (
+            (pd.to_numeric(df["audio_duration"]) * 1000).round().fillna(0).astype(int)
+        )
+    else:
+        audio_durations_ms = pd.Series(0, index=df.index)
+
+    transcript_outline = pd.DataFrame(
+        {
+            "category": df["category"].to_numpy()[start_positions],
+            "chapter": df["chapter"].to_numpy()[start_positions],
+            "chapter_code": chapter_codes.to_numpy()[start_positions],
+            "scene": df["scene"].to_numpy()[start_positions],
+            "start": start_positions,
+            "stop": pd.Series(start_positions).shift(-1, fill_value=len(df)),
+            "audio_duration_ms": audio_durations_ms.groupby(
+                run_starts.cumsum().to_numpy()
             )
+            .sum()
+            .to_numpy(),
+        }
+    )
 
-    # Terminate final scene and chapter
-    content_data += "</tbody></table></div></article></section>\n"
+    return transcript_outline
 
-    return content_data
+
+def create_toc_entries(transcript_outline: pd.DataFrame) -> dict:
+    """
+    The same toc_entries that HtmlSink builds up line by line, which every variant renders its table of contents from.
+    Made with one group-by over the runs in transcript_outline.
+    """
+    toc_entries = {}
+    chapter_durations_ms = transcript_outline.groupby(
+        ["category", "chapter"], sort=False
+    )["audio_duration_ms"].sum()
+
+    for (category, chapter), chapter_duration_ms in chapter_durations_ms.items():
+        toc_entries.setdefault(category, {})[chapter] = int(chapter_duration_ms)
+
+    return toc_entries
+
+
+def add_toc_entry(
+    toc_entries: dict, category: str, chapter: str, audio_duration: float = None
+) -> None:
+    """
+    toc_entries maps each category to its chapters, both in the order that they were first seen.
+    Each chapter holds the total length of its audio in milliseconds, so the total is the same whatever order the lines are added in.
+    """
+    chapters = toc_entries.setdefault(category, {})
+    chapters[chapter] = chapters.get(chapter, 0)
+
+    # NaN from a dataframe is also missing audio
+    if audio_duration is not None and audio_duration == audio_duration:
+        chapters[chapter] += round(audio_duration * 1000)
 
 
-def process_toc_html(df: pd.DataFrame, quests_only: bool) -> str:
+def render_toc_html(toc_entries: dict, quests_only: bool) -> str:
     toc_data = ""
     previous_category = "[start_of_loop]"
-    for category in df["category"].unique():
+    for category, chapters in toc_entries.items():
 
         # Move on to the next one if we have quests only enabled and the category is not a quest
         if quests_only:
@@ -364,7 +1828,7 @@ def process_toc_html(df: pd.DataFrame, quests_only: bool) -> str:
             if category_code >= 10:
                 continue
 
-        for chapter in df[df["category"] == category]["chapter"].unique():
+        for chapter, chapter_duration_ms in chapters.items():
             # Deal with categories first
             if category != previous_category:
                 # End the previous category
@@ -379,7 +1843,7 @@ def process_toc_html(df: pd.DataFrame, quests_only: bool) -> str:
 
             # Add in the chapters
             chapter_code = create_chapter_code(category, chapter)
-            toc_data += f'<li><a class="dropdown-item" href="#{chapter_code}">{chapter}</a></li>\n'
+            toc_data += f'<li><a class="dropdown-item" href="#{chapter_code}">{chapter}{render_duration_html(chapter_duration_ms)}</a></li>\n'
 
     # Terminate final category
     toc_data += "</ul></li>\n"
@@ -387,6 +1851,23 @@ def process_toc_html(df: pd.DataFrame, quests_only: bool) -> str:
     return toc_data
 
 
+def render_duration_html(duration_ms: int) -> str:
+    """
+    Length of a chapter's audio, e.g. " (12:05)". Empty if there is no audio or it wasn't scanned.
+    """
+    if duration_ms == 0:
+        return ""
+
+    minutes, seconds = divmod(round(duration_ms / 1000), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours > 0:
+        duration_text = f"{hours}:{minutes:02d}:{seconds:02d}"
+    else:
+        duration_text = f"{minutes}:{seconds:02d}"
+
+    return f' <span class="text-body-secondary">({duration_text})</span>'
+
+
 def create_chapter_code(category: str, chapter: str) -> str:
     chapter_code = spaces_to_underscores(category + "_" + chapter).strip()
 
@@ -423,28 +1904,27 @@ def categorise_chapters(
     return category
 
 
-def get_speaker(
-    resource: SentenceResource, scene_dict: dict, target_lang: ETextLanguages
-) -> str:
+def get_speaker_table(scene_data: dict, target_lang: ETextLanguages) -> dict:
     """
-    Work out the speaker's name in the target language for a given line
+    Work out the speaker's name in the target language for each voice in a scene, keyed by voice uuid.
+    Lines without a voice are looked up with None.
     """
+    speakers = {None: get_speaker(scene_data, None, target_lang)}
+    for voice_uuid in scene_data["voices"].keys():
+        speakers[voice_uuid] = get_speaker(scene_data, voice_uuid, target_lang)
+
+    return speakers
+
 
-    # Take a local copy as it will be modified
-    scene_dict_local = scene_dict.copy()
+def get_speaker(scene_data: dict, voice_uuid: str, target_lang: ETextLanguages) -> str:
+    """
+    Work out the speaker's name in the target language for a given voice
+    """
 
     # Work out the name but default to English if it can't be found in the target language
-    voice_str = ""
+    voice_str = get_voice_name(scene_data, voice_uuid, target_lang)
 
-    try:
-        voice_name = resource.voice.follow(scene_dict_local).text.follow(
-            scene_dict_local
-        )
-        if voice_name.language[target_lang] != "":
-            voice_str = voice_name.language[target_lang]
-        elif voice_name.language[ETextLanguages.English] != "":
-            voice_str = voice_name.language[ETextLanguages.English]
-    except:
+    if voice_str is None:
         voice_str = "<No voice name>"
 
     return voice_str
@@ -457,21 +1937,74 @@ def clean_brackets(input_string: str) -> str:
     return re.sub(r"<.*?>", "", input_string)
 
 
-def at9_to_mp3(
-    converter_path: str, input_file: str, output_file: str, print_output: bool
-) -> None:
+def create_benchmark_transcript(row_count: int) -> pd.DataFrame:
+    """
+    Made up transcript with the same columns as the real one, a mix of quest and non-quest categories,
+    chapters of 2000 lines and scenes of 40 lines
+    """
+    row_numbers = pd.Series(range(row_count))
+    chapter_numbers = (row_numbers // 2000).astype(str)
+    scene_numbers = (row_numbers // 40).astype(str)
+    category_numbers = (row_numbers // 20000 % 20).map("{:02d}".format)
+
+    df = pd.DataFrame(
+        {
+            "category": category_numbers + " Category " + category_numbers,
+            "chapter": "chapter_" + chapter_numbers,
+            "scene": "chapter_" + chapter_numbers + "_scene_" + scene_numbers,
+            "line": "line_" + row_numbers.astype(str),
+            "speaker": "Speaker " + (row_numbers % 7).astype(str),
+            "target_language": "Riga di prova numero " + row_numbers.astype(str),
+            "native_language": "Test line number " + row_numbers.astype(str),
+        }
+    )
 
-    temp_file = "temp.wav"
+    return df
 
-    # Convert at9 to wav
-    run_command([converter_path, input_file, temp_file], print_output)
 
-    # Wav to mp3
-    make_dir(output_file)
-    AudioSegment.from_wav(temp_file).export(output_file, format="mp3")
+def benchmark_html(row_count: int) -> None:
+    """
+    Times write_content_html against rendering the same transcript with df.iterrows and render_content_row,
+    for every variant in HTML_VARIANTS, and checks that both give the same html
+    """
+    df = create_benchmark_transcript(row_count)
+    print(f"Rendering {row_count} lines for {len(HTML_VARIANTS)} transcript variants")
+
+    start_time = time.perf_counter()
+    row_files = [io.StringIO() for html_variant in HTML_VARIANTS]
+    content_states = [create_content_state() for html_variant in HTML_VARIANTS]
+    for index, row in df.iterrows():
+        for file, content_state, (variant_name, toggle_nl, quests_only) in zip(
+            row_files, content_states, HTML_VARIANTS
+        ):
+            file.write(
+                render_content_row(
+                    content_state, row, "Italian", toggle_nl, quests_only
+                )
+            )
+
+    for file in row_files:
+        file.write(CONTENT_END_HTML)
+    row_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    column_files = [io.StringIO() for html_variant in HTML_VARIANTS]
+    write_content_html(column_files, df, "Italian", HTML_VARIANTS)
+    column_seconds = time.perf_counter() - start_time
+
+    print(
+        f"Row by row (iterrows): {row_seconds:.1f}s, {row_count / row_seconds:,.0f} rows per second"
+    )
+    print(
+        f"Column by column: {column_seconds:.1f}s, {row_count / column_seconds:,.0f} rows per second"
+    )
+    print(f"{row_seconds / column_seconds:.1f}x faster")
 
-    # Delete wav
-    delete_file(temp_file)
+    for row_file, column_file, (variant_name, toggle_nl, quests_only) in zip(
+        row_files, column_files, HTML_VARIANTS
+    ):
+        if row_file.getvalue() != column_file.getvalue():
+            print(f"[ERROR] The html for {variant_name} is different")
 
 
 if __name__ == "__main__":
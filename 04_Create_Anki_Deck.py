@@ -8,22 +8,29 @@ import html
 import random
 import json
 import re
+import sqlite3
 
 import pandas as pd
 import genanki
 from lemon_tizer import LemonTizer
 
 import settings
+from audio_converter import get_audio_extension
+from corpus_db import count_lines, get_corpus_db_path, open_corpus_db, search_lines
 from support import decima_lang_to_simplemma
 
 
 def main() -> None:
 
+    input_corpus = os.path.join(
+        settings.OUTPUT_FOLDER,
+        f"{settings.DECIMA_VERSION}_{settings.TARGET_LANG.name}_Subtitles.parquet",
+    )
     input_spreadsheet = os.path.join(
         settings.OUTPUT_FOLDER,
         f"{settings.DECIMA_VERSION}_{settings.TARGET_LANG.name}_Subtitles.xlsx",
     )
-    df_input = pd.read_excel(input_spreadsheet)
+    df_input = load_subtitles(input_corpus, input_spreadsheet)
 
     df_freq = frequency_analysis(
         df_input=df_input,
@@ -37,6 +44,9 @@ def main() -> None:
         exclude_list=settings.ANKI_EXCLUDE,
         max_cards=settings.ANKI_MAX_CARDS,
         lemmatize_words=settings.LEMMATIZE_WORDS,
+        corpus_db_path=get_corpus_db_path(
+            settings.OUTPUT_FOLDER, settings.DECIMA_VERSION, settings.TARGET_LANG.name
+        ),
     )
 
     build_anki_deck(
@@ -47,11 +57,26 @@ def main() -> None:
         game_name=settings.DECIMA_VERSION,
         dictionary_path=settings.DICTIONARY_PATH,
         word_audio_root=settings.WORD_AUDIO_PATH,
+        audio_extension=get_audio_extension(settings.AUDIO_PRESET),
     )
 
     print("Done! You can now close this window.")
 
 
+def load_subtitles(corpus_path: str, spreadsheet_path: str) -> pd.DataFrame:
+    """
+    Reads the parquet corpus written by 03_Build_Transcript.py, falling back to the spreadsheet for transcripts built before it existed
+    """
+    if file_exists(corpus_path):
+        print("Loading subtitles from " + corpus_path)
+        df_input = pd.read_parquet(corpus_path)
+    else:
+        print("Loading subtitles from " + spreadsheet_path)
+        df_input = pd.read_excel(spreadsheet_path)
+
+    return df_input
+
+
 def build_anki_deck(
     df: pd.DataFrame,
     target_language_name: str,
@@ -60,6 +85,7 @@ def build_anki_deck(
     game_name: str,
     dictionary_path: str,
     word_audio_root: str,
+    audio_extension: str = "mp3",
 ) -> None:
 
     print("Create Anki: Setting up")
@@ -118,7 +144,7 @@ def build_anki_deck(
 
         # Put the file names for the audio into Anki card format
         sentence_audio_field_anki = sanitise_string_html(
-            format_audio_field(line + ".mp3")
+            format_audio_field(line + "." + audio_extension)
         )
         word_audio_field_anki = sanitise_string_html(format_audio_field(word + ".mp3"))
 
@@ -129,6 +155,7 @@ def build_anki_deck(
             scene=scene,
             line=line,
             target_language_name=target_language_name,
+            audio_extension=audio_extension,
         )
         word_audio_path = find_file(word_audio_root, word + ".mp3")
 
@@ -186,6 +213,7 @@ def frequency_analysis(
     exclude_list: list,
     max_cards: int,
     lemmatize_words: bool,
+    corpus_db_path: str = None,
 ) -> pd.DataFrame:
 
     print("Frequency analysis: loading language model")
@@ -201,9 +229,7 @@ def frequency_analysis(
     df_freq_table = pd.DataFrame(columns=["word", "example", "frequency"])
     total_size = len(df_input)
     i = 0
-    for index, row in df_input.iterrows():
-        line = row["target_language"]
-
+    for line in df_input["target_language"]:
         word_list = lemma.lemmatize_sentence(input_str=line)
 
         for word_dict in word_list:
@@ -262,14 +288,22 @@ def frequency_analysis(
         native_language=" ",
     )
 
+    # Use the corpus database to look up the examples if it was built alongside df_input
+    corpus_connection = None
+    if corpus_db_path is not None:
+        corpus_connection = open_corpus_db(corpus_db_path)
+
+    if corpus_connection is not None and count_lines(corpus_connection) != len(
+        df_input
+    ):
+        print("Corpus database doesn't match the subtitles, searching them instead")
+        corpus_connection.close()
+        corpus_connection = None
+
     # Grab the examples for each word
     for index, row in df_freq_table.iterrows():
 
-        line = df_input[
-            df_input["target_language"].apply(
-                lambda x: full_word_match(x, row["example"])
-            )
-        ].head(1)
+        line = find_example_line(df_input, corpus_connection, row["example"])
 
         df_freq_table.at[index, "category"] = line["category"].values
         df_freq_table.at[index, "chapter"] = line["chapter"].values
@@ -279,6 +313,9 @@ def frequency_analysis(
         df_freq_table.at[index, "target_language"] = line["target_language"].values
         df_freq_table.at[index, "native_language"] = line["native_language"].values
 
+    if corpus_connection is not None:
+        corpus_connection.close()
+
     print("Frequency analysis: Exporting")
     output_spreadsheet = os.path.join(
         output_directory, f"{game_name}_{target_language_name}_Frequency_analysis.xlsx"
@@ -288,6 +325,35 @@ def frequency_analysis(
     return df_freq_table
 
 
+def find_example_line(
+    df_input: pd.DataFrame, corpus_connection: sqlite3.Connection, word: str
+) -> pd.DataFrame:
+    """
+    Returns the first line of df_input that contains word, as a dataframe with zero or one rows.
+    The full text index narrows it down to a handful of candidates, full_word_match then has the final say so the result is the same as scanning df_input.
+    If the line in df_input isn't the one in the database (e.g. the database is left over from an older build) or the index has no match, df_input is scanned instead.
+    """
+    if corpus_connection is None:
+        line = df_input[
+            df_input["target_language"].apply(lambda x: full_word_match(x, word))
+        ].head(1)
+
+        return line
+
+    for result in search_lines(corpus_connection, str(word)):
+        if full_word_match(result["target_language"], word):
+            # Lines are numbered from 1 in the same order as df_input
+            line = df_input.iloc[[result["id"] - 1]]
+
+            if line["target_language"].iloc[0] != result["target_language"]:
+                return find_example_line(df_input, None, word)
+
+            return line
+
+    # The index splits words differently to full_word_match (e.g. on apostrophes), so scan before giving up
+    return find_example_line(df_input, None, word)
+
+
 def full_word_match(target: str, word: str) -> bool:
     pattern = r"\b" + re.escape(word) + r"\b"
 
@@ -318,7 +384,12 @@ def format_audio_field(filename: str) -> str:
 
 
 def get_audio_filepath(
-    output_folder: str, chapter: str, scene: str, line: str, target_language_name: str
+    output_folder: str,
+    chapter: str,
+    scene: str,
+    line: str,
+    target_language_name: str,
+    audio_extension: str = "mp3",
 ) -> str:
 
     audio_path = os.path.join(
@@ -327,7 +398,7 @@ def get_audio_filepath(
         chapter,
         scene,
         target_language_name.lower(),
-        line + ".mp3",
+        line + "." + audio_extension,
     )
 
     return audio_path
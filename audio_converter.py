@@ -0,0 +1,1258 @@
+"""
+Converts the game's .at9 audio to mp3 (or another format from AUDIO_PRESETS) for the transcript and Anki deck.
+
+Conversions are run on a bounded pool of threads so that they can happen while the scenes are still being extracted.
+Jobs are converted in category order ("00 Intro" first, "20 NPC Lines" near the end), so a partial run has the most useful audio.
+The conversion itself is done by one of the backends in AUDIO_BACKENDS:
+vgaudio decodes with VGAudioCli to a temporary wav and encodes it with ffmpeg through pydub (Windows only, as VGAudioCli is a .exe)
+ffmpeg decodes the ATRAC9 and encodes the mp3 in a single ffmpeg process, so the audio never touches the disk in between and it runs on any OS
+A ledger of previous conversions is kept so that mp3 files that are already up to date aren't converted again.
+Many lines reuse the same recording, so each unique at9 file is converted once and its copies are hard linked to the result.
+The audio can either be read from the .at9 files written by the sentence dumper or sliced straight out of each scene's .stream file (see get_stream_source).
+Every job is written to a journal when it is queued and again when it is finished, so a build that is stopped part way through carries on where it left off.
+Only one converter at a time uses the journal. A build that finds it in use hands its jobs off in a separate file, which is picked up by the next converter to use the journal.
+
+Run it directly to convert the jobs left in the journal, e.g. after the transcript was built with AUDIO_IN_BACKGROUND = True:
+python audio_converter.py
+Or to compare the encode time and file size of each audio preset on a sample of the game's audio:
+python audio_converter.py --benchmark --files 100
+"""
+
+import os
+import glob
+import json
+import time
+import queue
+import tempfile
+import threading
+import sys
+import argparse
+import struct
+import subprocess
+
+from pydub import AudioSegment
+
+import settings
+from support import (
+    delete_file,
+    file_exists,
+    get_file_stat,
+    hash_file,
+    link_file,
+    get_script_dir,
+    hash_bytes,
+    lock_file,
+    make_dir,
+    open_atomic,
+    run_command,
+    unlock_file,
+    write_json,
+)
+
+LEDGER_VERSION = 1
+AUDIO_LEDGER_FILENAME = "Audio_Ledger.json"
+AUDIO_JOURNAL_FILENAME = "Audio_Journal.jsonl"
+AUDIO_LOG_FILENAME = "Audio_Background.log"
+
+# How often the ledger is saved while converting, so that a run that is killed doesn't lose track of what it converted
+LEDGER_SAVE_SECONDS = 30
+
+# How often the progress of each category is printed
+PROGRESS_SECONDS = 30
+
+# How often a converter that is waiting for the journal checks whether it is free yet
+JOURNAL_LOCK_SECONDS = 1
+
+# audio_type values of sounds that are stored as ATRAC9
+AT9_AUDIO_TYPES = [0x09, 0x0D]
+
+# Only the start of the fmt chunk is needed, the ATRAC9 specific fields after the channel mask are skipped
+FMT_CHUNK_BYTES = 24
+
+# File extension, ffmpeg output format and extra ffmpeg arguments for each audio preset
+# mp3 is ffmpeg's default mp3 encoding, which is what was always used. opus and speech are much smaller but older versions of Safari can't play them.
+AUDIO_PRESETS = {
+    "mp3": {"extension": "mp3", "format": "mp3", "parameters": []},
+    "mp3_vbr": {
+        "extension": "mp3",
+        "format": "mp3",
+        "parameters": ["-codec:a", "libmp3lame", "-q:a", "5"],
+    },
+    "opus": {
+        "extension": "ogg",
+        "format": "ogg",
+        "parameters": ["-codec:a", "libopus", "-b:a", "48k"],
+    },
+    "speech": {
+        "extension": "ogg",
+        "format": "ogg",
+        "parameters": [
+            "-codec:a",
+            "libopus",
+            "-b:a",
+            "16k",
+            "-ac",
+            "1",
+            "-application",
+            "voip",
+        ],
+    },
+}
+
+
+class AudioConverter:
+    """
+    Pool of threads that converts at9 files using backend.
+    The work is done by the converter and ffmpeg processes, so threads are enough to keep every core busy.
+    Jobs are taken from a priority queue in order of category, which sort in priority order as they start with a number (see CHAPTER_IDENTIFIERS in settings.py).
+    At most workers * 4 new conversions are queued at once. submit() blocks when the queue is full, which stops extraction from getting too far ahead.
+    If queue_only is set, jobs are only written to the journal so that they can be converted later by running this script.
+    Only one converter at a time can use a journal (and its ledger). If wait_for_journal is set, this waits for the journal to be free.
+    Otherwise, if another converter is using it (e.g. the last build's background conversion), the jobs are queued in a handoff file instead, see handoff_path.
+    """
+
+    def __init__(
+        self,
+        backend,
+        workers: int = 0,
+        ledger_path: str = None,
+        journal_path: str = None,
+        queue_only: bool = False,
+        wait_for_journal: bool = False,
+    ) -> None:
+        if workers == 0:
+            workers = os.cpu_count() or 1
+
+        self.backend = backend
+        self.workers = workers
+        self.job_queue = queue.PriorityQueue()
+        self.job_count = 0
+        self.queue_slots = threading.BoundedSemaphore(workers * 4)
+
+        # Taken before the ledger is loaded, as the ledger is saved by whoever holds the journal
+        self.journal_lock = None
+        self.handoff_path = None
+        self.handoff_jobs = {}
+        if journal_path is not None:
+            if wait_for_journal:
+                self.journal_lock = lock_journal(journal_path)
+            else:
+                self.journal_lock = lock_file(get_journal_lock_path(journal_path))
+
+            if self.journal_lock is None:
+                print(
+                    f"Another audio conversion is using {journal_path}, e.g. the background conversion from the last build. The audio will be queued for after it has finished."
+                )
+                self.handoff_path = get_handoff_path(journal_path)
+                journal_path = None
+                queue_only = True
+            else:
+                adopt_handoff_journals(journal_path)
+
+        # Conversions are only skipped if there is a ledger to check them against
+        self.ledger_path = ledger_path
+        self.ledger = None
+        if ledger_path is not None and not queue_only:
+            self.ledger = load_ledger(ledger_path, get_conversion_options(backend))
+        self.ledger_saved = time.perf_counter()
+
+        self.journal = None
+        if journal_path is not None:
+            self.journal = AudioJobJournal(journal_path)
+        self.queue_only = queue_only
+        self.queued_files = 0
+
+        # Hash of each at9 file that has been seen -> where its mp3 is and whether it is ready to be linked to
+        self.payloads = {}
+
+        self.lock = threading.Lock()
+        self.stats = {
+            "files": 0,
+            "linked": 0,
+            "skipped": 0,
+            "failed": 0,
+            "audio_seconds": 0.0,
+        }
+        self.start_time = None
+
+        # Category -> [files finished, files queued]
+        self.category_progress = {}
+        self.progress_reported = time.perf_counter()
+
+        # Daemon threads, so that Ctrl-C doesn't wait for them. Unfinished jobs are still in the journal.
+        self.threads = []
+        if not queue_only:
+            for _ in range(workers):
+                thread = threading.Thread(target=self.run_worker, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(
+        self,
+        input_file: str,
+        output_file: str,
+        category: str = settings.DEFAULT_CATEGORY,
+    ) -> None:
+        if self.journal is not None:
+            self.journal.add(input_file, output_file, category)
+        if self.handoff_path is not None:
+            self.handoff_jobs[output_file] = (input_file, category)
+
+        self.queued_files += 1
+        if not self.queue_only:
+            self.queue_slots.acquire()
+            self.queue_conversion(input_file, output_file, category, True)
+
+    def resume(self) -> int:
+        """
+        Queues the jobs that were left unfinished by a previous run and returns how many there were
+        """
+        if self.journal is None or self.queue_only:
+            return 0
+
+        pending_jobs = self.journal.get_pending()
+        if len(pending_jobs) > 0:
+            print(
+                f"Resuming {len(pending_jobs)} audio files left over from the last run"
+            )
+
+        # These are already in memory, so they don't take up any of the queue slots
+        for input_file, output_file, category in pending_jobs:
+            self.queue_conversion(input_file, output_file, category, False)
+
+        return len(pending_jobs)
+
+    def queue_conversion(
+        self, input_file: str, output_file: str, category: str, holds_slot: bool
+    ) -> None:
+        if self.start_time is None:
+            self.start_time = time.perf_counter()
+
+        with self.lock:
+            self.job_count += 1
+            self.category_progress.setdefault(category, [0, 0])[1] += 1
+
+            # Jobs start with 0 so that they always come before the 1 that tells the workers to stop
+            job = (0, category, self.job_count, input_file, output_file, holds_slot)
+
+        self.job_queue.put(job)
+
+    def run_worker(self) -> None:
+        while True:
+            job = self.job_queue.get()
+            if job[0] == 1:
+                return
+
+            _, category, _, input_file, output_file, holds_slot = job
+            try:
+                self.convert(input_file, output_file)
+            except Exception as e:
+                print(f"[ERROR] Couldn't convert {input_file}: {e}")
+                with self.lock:
+                    self.stats["failed"] += 1
+            finally:
+                if holds_slot:
+                    self.queue_slots.release()
+
+            self.update_progress(category)
+
+    def update_progress(self, category: str) -> None:
+        with self.lock:
+            self.category_progress[category][0] += 1
+
+            if time.perf_counter() - self.progress_reported < PROGRESS_SECONDS:
+                return
+
+            self.progress_reported = time.perf_counter()
+            progress_text = format_category_progress(self.category_progress)
+
+        print("Audio progress: " + progress_text)
+
+    def convert(self, input_file: str, output_file: str) -> None:
+        source_stat = get_source_stat(input_file)
+
+        if self.ledger is not None:
+            with self.lock:
+                ledger_entry = self.ledger["files"].get(output_file)
+
+            if is_conversion_current(
+                ledger_entry, input_file, source_stat, output_file
+            ):
+                # Still available for any copies of this recording that need converting
+                payload, is_first = self.claim_payload(
+                    ledger_entry["source_hash"], output_file
+                )
+                if is_first:
+                    self.finish_payload(payload, True)
+
+                with self.lock:
+                    self.stats["skipped"] += 1
+                self.finish_job(output_file)
+                return
+
+        # Copies of a recording wait for the first one to be converted and then link to it.
+        # The payload is always finished, even if this raises, so the copies never wait forever. Failures are raised to run_worker.
+        source_hash = hash_source(input_file)
+        payload, is_first = self.claim_payload(source_hash, output_file)
+        converted = False
+        try:
+            if not is_first:
+                payload["done"].wait()
+
+                if not payload["converted"]:
+                    raise RuntimeError(
+                        f"{payload['output_file']} from the same recording couldn't be converted"
+                    )
+
+                if self.link(payload["output_file"], output_file):
+                    self.add_result(
+                        "linked", 0.0, input_file, source_stat, source_hash, output_file
+                    )
+                    self.finish_job(output_file)
+                    return
+
+            audio_seconds = self.backend.convert(input_file, output_file)
+            self.add_result(
+                "files",
+                audio_seconds,
+                input_file,
+                source_stat,
+                source_hash,
+                output_file,
+            )
+            converted = True
+        finally:
+            if is_first:
+                self.finish_payload(payload, converted)
+
+        self.finish_job(output_file)
+
+    def finish_job(self, output_file: str) -> None:
+        """
+        Failed jobs aren't finished, so they are tried again next time
+        """
+        if self.journal is not None:
+            self.journal.finish(output_file)
+
+    def claim_payload(self, source_hash: str, output_file: str) -> tuple:
+        """
+        Returns the payload for this hash and True if this is the first time it has been seen, in which case the caller has to finish it
+        """
+        with self.lock:
+            if source_hash in self.payloads:
+                return self.payloads[source_hash], False
+
+            payload = {
+                "output_file": output_file,
+                "converted": False,
+                "done": threading.Event(),
+            }
+            self.payloads[source_hash] = payload
+
+        return payload, True
+
+    def finish_payload(self, payload: dict, converted: bool) -> None:
+        payload["converted"] = converted
+        payload["done"].set()
+
+    def link(self, source_file: str, output_file: str) -> bool:
+        try:
+            link_file(source_file, output_file)
+        except OSError as e:
+            print(f"[ERROR] Couldn't link {output_file} to {source_file}: {e}")
+            return False
+
+        return True
+
+    def add_result(
+        self,
+        stat_name: str,
+        audio_seconds: float,
+        input_file: str,
+        source_stat: list,
+        source_hash: str,
+        output_file: str,
+    ) -> None:
+        ledger_entry = create_ledger_entry(
+            input_file, source_stat, source_hash, output_file
+        )
+
+        with self.lock:
+            self.stats[stat_name] += 1
+            self.stats["audio_seconds"] += audio_seconds
+
+            if self.ledger is not None:
+                self.ledger["files"][output_file] = ledger_entry
+
+                if time.perf_counter() - self.ledger_saved > LEDGER_SAVE_SECONDS:
+                    save_ledger(self.ledger_path, self.ledger)
+                    self.ledger_saved = time.perf_counter()
+
+    def close(self) -> None:
+        """
+        Waits for the queued conversions to finish and prints the throughput
+        """
+        for thread in self.threads:
+            self.job_queue.put((1, "", 0, None, None, False))
+
+        for thread in self.threads:
+            thread.join()
+
+        if self.ledger is not None:
+            save_ledger(self.ledger_path, self.ledger)
+
+        if self.journal is not None:
+            self.journal.close()
+
+        # Written in one go, so the converter that adopts it never sees half of it
+        if self.handoff_path is not None and len(self.handoff_jobs) > 0:
+            write_journal(self.handoff_path, self.handoff_jobs)
+
+        if self.journal_lock is not None:
+            unlock_file(self.journal_lock)
+            self.journal_lock = None
+
+        if self.queue_only:
+            print(f"Queued {self.queued_files} audio files for conversion")
+            return
+
+        if self.start_time is None:
+            return
+
+        print_audio_stats(self.stats, time.perf_counter() - self.start_time)
+        print("Audio by category: " + format_category_progress(self.category_progress))
+
+
+class AudioJobJournal:
+    """
+    Persistent queue of (at9, output, category) jobs, stored as one json object per line.
+    {"add": [at9, output, category]} is written when a job is queued and {"finish": output} when it is done, so the jobs that are still pending can be worked out after a crash.
+    Every line is flushed as it is written. The file is compacted when it is opened and deleted once there is nothing left to do.
+    """
+
+    def __init__(self, journal_path: str) -> None:
+        self.journal_path = journal_path
+        self.lock = threading.Lock()
+
+        # Output file -> (at9 file, category), for every job that hasn't finished yet
+        self.pending = read_journal(journal_path)
+        write_journal(journal_path, self.pending)
+
+        self.file = open(journal_path, "a", encoding="utf-8")
+
+    def add(self, input_file: str, output_file: str, category: str) -> None:
+        with self.lock:
+            self.pending[output_file] = (input_file, category)
+            self.write_entry({"add": [input_file, output_file, category]})
+
+    def finish(self, output_file: str) -> None:
+        with self.lock:
+            self.pending.pop(output_file, None)
+            self.write_entry({"finish": output_file})
+
+    def write_entry(self, entry: dict) -> None:
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def get_pending(self) -> list:
+        """
+        (at9, output, category) for each job that hasn't finished, in category order and then the order they were queued
+        """
+        with self.lock:
+            pending_jobs = [
+                (input_file, output_file, category)
+                for output_file, (input_file, category) in self.pending.items()
+            ]
+
+        pending_jobs.sort(key=lambda job: job[2])
+
+        return pending_jobs
+
+    def close(self) -> None:
+        self.file.close()
+
+        if len(self.pending) == 0:
+            delete_file(self.journal_path)
+
+
+def get_journal_lock_path(journal_path: str) -> str:
+    return journal_path + ".lock"
+
+
+def get_handoff_path(journal_path: str) -> str:
+    return f"{journal_path}.{os.getpid()}.handoff"
+
+
+def find_handoff_journals(journal_path: str) -> list:
+    return sorted(glob.glob(glob.escape(journal_path) + ".*.handoff"))
+
+
+def adopt_handoff_journals(journal_path: str) -> None:
+    """
+    Moves the jobs that other converters handed off while the journal was in use into the journal.
+    Only call this while holding the journal's lock.
+    """
+    handoff_paths = find_handoff_journals(journal_path)
+    if len(handoff_paths) == 0:
+        return
+
+    pending = read_journal(journal_path)
+    for handoff_path in handoff_paths:
+        pending.update(read_journal(handoff_path))
+    write_journal(journal_path, pending)
+
+    for handoff_path in handoff_paths:
+        delete_file(handoff_path)
+
+
+def lock_journal(journal_path: str):
+    """
+    Waits until no other process is using the journal and then locks it. The lock is released when the process exits, even if it crashes.
+    """
+    lock_path = get_journal_lock_path(journal_path)
+
+    journal_lock = lock_file(lock_path)
+    if journal_lock is None:
+        print(
+            f"Another audio conversion is using {journal_path}, e.g. the background conversion from the last build. Waiting for it to finish."
+        )
+
+    while journal_lock is None:
+        time.sleep(JOURNAL_LOCK_SECONDS)
+        journal_lock = lock_file(lock_path)
+
+    return journal_lock
+
+
+def read_journal(journal_path: str) -> dict:
+    """
+    Replays the journal and returns the jobs that haven't finished, in the order they were queued
+    """
+    pending = {}
+    if not file_exists(journal_path):
+        return pending
+
+    with open(journal_path, "r", encoding="utf-8") as file:
+        for journal_line in file:
+            try:
+                entry = json.loads(journal_line)
+            except ValueError:
+                # The last line can be cut short if the script was killed while writing it
+                continue
+
+            if "add" in entry:
+                input_file, output_file, category = entry["add"]
+                pending[output_file] = (input_file, category)
+            elif "finish" in entry:
+                pending.pop(entry["finish"], None)
+
+    return pending
+
+
+def write_journal(journal_path: str, pending: dict) -> None:
+    with open_atomic(journal_path) as file:
+        for output_file, (input_file, category) in pending.items():
+            file.write(
+                json.dumps(
+                    {"add": [input_file, output_file, category]}, ensure_ascii=False
+                )
+                + "\n"
+            )
+
+
+def start_background_conversion(
+    backend_name: str,
+    preset_name: str,
+    converter_path: str,
+    workers: int,
+    journal_path: str,
+    ledger_path: str,
+    log_path: str,
+) -> None:
+    """
+    Runs this script in a separate process that converts the jobs in the journal and carries on after the calling script exits.
+    Its output goes to log_path.
+    """
+    command_list = [
+        sys.executable,
+        os.path.join(get_script_dir(), "audio_converter.py"),
+        "--backend",
+        backend_name,
+        "--preset",
+        preset_name,
+        "--converter",
+        converter_path,
+        "--workers",
+        str(workers),
+        "--journal",
+        journal_path,
+        "--ledger",
+        ledger_path if ledger_path is not None else "",
+    ]
+
+    # Detach from the console so that closing the window doesn't stop it
+    if os.name == "nt":
+        process_options = {
+            "creationflags": subprocess.DETACHED_PROCESS
+            | subprocess.CREATE_NEW_PROCESS_GROUP
+        }
+    else:
+        process_options = {"start_new_session": True}
+
+    make_dir(log_path)
+    with open(log_path, "w", encoding="utf-8") as log_file:
+        subprocess.Popen(
+            command_list,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            **process_options,
+        )
+
+    print(
+        f"Converting the audio in the background, see {log_path} for progress. "
+        "If it is stopped, type python audio_converter.py to carry on."
+    )
+
+
+def format_category_progress(category_progress: dict) -> str:
+    progress_text = ", ".join(
+        f"{category} {done}/{queued}"
+        for category, (done, queued) in sorted(category_progress.items())
+    )
+
+    return progress_text
+
+
+def print_audio_stats(stats: dict, elapsed_seconds: float) -> None:
+    elapsed_seconds = max(elapsed_seconds, 0.001)
+
+    print(
+        f"Converted {stats['files']} audio files ({stats['audio_seconds']:.1f}s of audio) in {elapsed_seconds:.1f}s: "
+        f"{stats['files'] / elapsed_seconds:.1f} files/s, {stats['audio_seconds'] / elapsed_seconds:.1f}s of audio per second"
+    )
+
+    if stats["linked"] > 0:
+        print(
+            f"Linked {stats['linked']} audio files that were copies of another recording"
+        )
+
+    if stats["skipped"] > 0:
+        print(f"Skipped {stats['skipped']} audio files that were already up to date")
+
+    if stats["failed"] > 0:
+        print(f"[WARNING] {stats['failed']} audio files couldn't be converted")
+
+
+def get_conversion_options(backend) -> dict:
+    """
+    Everything other than the source file that affects the mp3. The ledger is thrown away if any of them change.
+    """
+    conversion_options = {
+        "ledger_version": LEDGER_VERSION,
+        "backend": backend.get_options(),
+    }
+
+    return conversion_options
+
+
+def create_ledger(conversion_options: dict) -> dict:
+    ledger = {"options": conversion_options, "files": {}}
+
+    return ledger
+
+
+def load_ledger(ledger_path: str, conversion_options: dict) -> dict:
+    """
+    Loads the ledger from the previous run. Starts a new one if it is missing, unreadable or was made with different settings.
+    """
+    if not file_exists(ledger_path):
+        return create_ledger(conversion_options)
+
+    try:
+        with open(ledger_path, "r", encoding="utf-8") as file:
+            ledger = json.load(file)
+    except (OSError, ValueError):
+        print(f"Could not read {ledger_path}, converting all audio")
+        return create_ledger(conversion_options)
+
+    if ledger.get("options") != conversion_options:
+        print("Audio settings have changed since the last run, converting all audio")
+        return create_ledger(conversion_options)
+
+    return ledger
+
+
+def save_ledger(ledger_path: str, ledger: dict) -> None:
+    write_json(ledger_path, ledger, separators=(",", ":"))
+
+
+def create_ledger_entry(
+    input_file: str, source_stat: list, source_hash: str, output_file: str
+) -> dict:
+    ledger_entry = {
+        "source": input_file,
+        "source_stat": source_stat,
+        "source_hash": source_hash,
+        "output_mtime": get_file_stat(output_file)[1],
+    }
+
+    return ledger_entry
+
+
+def is_conversion_current(
+    ledger_entry: dict, input_file: str, source_stat: list, output_file: str
+) -> bool:
+    """
+    True if the mp3 is still the one that the ledger recorded and its source hasn't changed.
+    The source is only hashed if its size or modification time has changed, e.g. after being dumped again.
+    """
+    if ledger_entry is None or ledger_entry["source"] != input_file:
+        return False
+
+    output_stat = get_file_stat(output_file)
+    if output_stat is None or output_stat[1] != ledger_entry["output_mtime"]:
+        return False
+
+    if source_stat == ledger_entry["source_stat"]:
+        return True
+
+    if hash_source(input_file) != ledger_entry["source_hash"]:
+        return False
+
+    # Same content, so remember the new stat to avoid hashing it next time
+    ledger_entry["source_stat"] = source_stat
+
+    return True
+
+
+class VGAudioBackend:
+    """
+    Decodes with VGAudioCli to a temporary wav, which pydub then encodes with ffmpeg
+    """
+
+    name = "vgaudio"
+
+    def __init__(
+        self, converter_path: str, preset: dict = AUDIO_PRESETS["mp3"]
+    ) -> None:
+        self.converter_path = converter_path
+        self.preset = preset
+
+    def get_options(self) -> dict:
+        backend_options = {
+            "name": self.name,
+            "converter_path": self.converter_path,
+            "converter_stat": get_file_stat(self.converter_path),
+            "preset": self.preset,
+        }
+
+        return backend_options
+
+    def convert(self, input_file: str, output_file: str) -> float:
+        if split_stream_source(input_file) is None:
+            return at9_to_mp3(
+                self.converter_path, input_file, output_file, False, self.preset
+            )
+
+        # VGAudioCli can only read files, so the slice is written to a temporary at9 file
+        temp_handle, temp_file = tempfile.mkstemp(suffix=".at9")
+        with os.fdopen(temp_handle, "wb") as file:
+            file.write(read_source(input_file))
+
+        try:
+            audio_seconds = at9_to_mp3(
+                self.converter_path, temp_file, output_file, False, self.preset
+            )
+        finally:
+            delete_file(temp_file)
+
+        return audio_seconds
+
+
+class FfmpegBackend:
+    """
+    ffmpeg reads the at9 file itself (ATRAC9 support was added in ffmpeg 4.1) and pipes the decoded audio straight into the encoder
+    """
+
+    name = "ffmpeg"
+
+    def __init__(
+        self, preset: dict = AUDIO_PRESETS["mp3"], ffmpeg_path: str = "ffmpeg"
+    ) -> None:
+        self.preset = preset
+        self.ffmpeg_path = ffmpeg_path
+
+    def get_options(self) -> dict:
+        backend_options = {
+            "name": self.name,
+            "ffmpeg_path": self.ffmpeg_path,
+            "preset": self.preset,
+        }
+
+        return backend_options
+
+    def convert(self, input_file: str, output_file: str) -> float:
+        return at9_to_mp3_ffmpeg(self.ffmpeg_path, input_file, output_file, self.preset)
+
+
+AUDIO_BACKENDS = {
+    VGAudioBackend.name: VGAudioBackend,
+    FfmpegBackend.name: FfmpegBackend,
+}
+
+
+def create_audio_backend(
+    backend_name: str, converter_path: str, preset_name: str = "mp3"
+):
+    """
+    Returns the backend from AUDIO_BACKENDS called backend_name, encoding with the preset from AUDIO_PRESETS called preset_name.
+    converter_path is only used by vgaudio.
+    """
+    preset = get_audio_preset(preset_name)
+
+    if backend_name == VGAudioBackend.name:
+        return VGAudioBackend(converter_path, preset)
+
+    if backend_name not in AUDIO_BACKENDS:
+        raise ValueError(
+            f"Unknown audio backend {backend_name}, it should be one of {', '.join(AUDIO_BACKENDS.keys())}"
+        )
+
+    return AUDIO_BACKENDS[backend_name](preset)
+
+
+def get_audio_preset(preset_name: str) -> dict:
+    if preset_name not in AUDIO_PRESETS:
+        raise ValueError(
+            f"Unknown audio preset {preset_name}, it should be one of {', '.join(AUDIO_PRESETS.keys())}"
+        )
+
+    return AUDIO_PRESETS[preset_name]
+
+
+def get_audio_extension(preset_name: str) -> str:
+    """
+    Extension of the sentence audio files, which the transcript and Anki deck need to find them
+    """
+    return get_audio_preset(preset_name)["extension"]
+
+
+def get_stream_source(stream_path: str, start: int, size: int) -> str:
+    """
+    Name for the audio at [start, start + size) in a .stream file. It can be used anywhere that the path of an at9 file can.
+    | can't appear in a Windows path, and the offsets are split off from the right, so it is never ambiguous.
+    """
+    return f"{stream_path}|{start}|{size}"
+
+
+def split_stream_source(input_file: str) -> tuple:
+    """
+    (stream path, start, size) if input_file came from get_stream_source, otherwise None
+    """
+    source_parts = input_file.rsplit("|", 2)
+    if len(source_parts) != 3 or not (
+        source_parts[1].isdigit() and source_parts[2].isdigit()
+    ):
+        return None
+
+    return source_parts[0], int(source_parts[1]), int(source_parts[2])
+
+
+def read_source(input_file: str) -> bytes:
+    stream_source = split_stream_source(input_file)
+    if stream_source is None:
+        with open(input_file, "rb") as file:
+            return file.read()
+
+    stream_path, start, size = stream_source
+    with open(stream_path, "rb") as file:
+        file.seek(start)
+        source_data = file.read(size)
+
+    if len(source_data) != size:
+        raise ValueError(f"{stream_path} is too short for {input_file}")
+
+    return source_data
+
+
+def hash_source(input_file: str) -> str:
+    """
+    A slice of a .stream file hashes the same as the at9 file that the sentence dumper would write for it
+    """
+    if split_stream_source(input_file) is None:
+        return hash_file(input_file)
+
+    return hash_bytes(read_source(input_file))
+
+
+def get_source_stat(input_file: str) -> list:
+    """
+    For a slice, the stat of the whole .stream file. The offsets are part of the name so don't need to be included.
+    """
+    stream_source = split_stream_source(input_file)
+    if stream_source is None:
+        return get_file_stat(input_file)
+
+    return get_file_stat(stream_source[0])
+
+
+def get_source_span(input_file: str) -> tuple:
+    """
+    (file path, start, size in bytes) of an at9 file or a slice of a .stream file
+    """
+    stream_source = split_stream_source(input_file)
+    if stream_source is None:
+        return input_file, 0, os.path.getsize(input_file)
+
+    return stream_source
+
+
+def scan_at9_header(input_file: str) -> dict:
+    """
+    Reads the RIFF header of an at9 file (or slice) without decoding any audio.
+    Returns the channels, channel mask, sample rate, sample count and duration in seconds, plus whether the data chunk is complete.
+    Returns None if the file can't be read or isn't a RIFF file.
+    A warning is printed for every file that isn't playable, as it won't be converted.
+    """
+    try:
+        stream_path, start, total_size = get_source_span(input_file)
+        with open(stream_path, "rb") as file:
+            file.seek(start)
+            audio_header = read_riff_chunks(file, start, total_size)
+    except (OSError, ValueError) as e:
+        print(f"[WARNING] Skipping the audio {input_file}: {e}")
+        return None
+
+    if not audio_header["complete"]:
+        print(f"[WARNING] Skipping the audio {input_file}: it is cut off")
+    elif audio_header["sample_count"] == 0:
+        print(f"[WARNING] Skipping the audio {input_file}: it is empty")
+
+    return audio_header
+
+
+def read_riff_chunks(file, start: int, total_size: int) -> dict:
+    """
+    Walks the RIFF chunks of the file at start until the data chunk, skipping over the body of any chunk that isn't needed.
+    ATRAC9 keeps the sample count in the fact chunk. Plain PCM files don't have one, so it is worked out from the size of the data.
+    """
+    riff_header = file.read(12)
+    if (
+        len(riff_header) < 12
+        or riff_header[0:4] != b"RIFF"
+        or riff_header[8:12] != b"WAVE"
+    ):
+        raise ValueError("it isn't a RIFF file")
+
+    audio_header = {
+        "channels": 0,
+        "channel_mask": 0,
+        "sample_rate": 0,
+        "sample_count": None,
+        "duration": 0.0,
+        "complete": False,
+    }
+    block_align = 0
+
+    chunk_offset = 12
+    while chunk_offset + 8 <= total_size:
+        chunk_header = file.read(8)
+        if len(chunk_header) < 8:
+            break
+        chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+
+        if chunk_id == b"fmt ":
+            chunk_data = file.read(min(chunk_size, FMT_CHUNK_BYTES))
+            if len(chunk_data) >= 16:
+                (
+                    audio_header["channels"],
+                    audio_header["sample_rate"],
+                    _,
+                    block_align,
+                ) = struct.unpack_from("<HIIH", chunk_data, 2)
+
+            # WAVE_FORMAT_EXTENSIBLE, which ATRAC9 uses, has the speaker layout after the usual fields
+            if len(chunk_data) >= 24:
+                audio_header["channel_mask"] = struct.unpack_from("<I", chunk_data, 20)[
+                    0
+                ]
+        elif chunk_id == b"fact":
+            chunk_data = file.read(min(chunk_size, 4))
+            if len(chunk_data) == 4:
+                audio_header["sample_count"] = struct.unpack("<I", chunk_data)[0]
+        elif chunk_id == b"data":
+            audio_header["complete"] = chunk_offset + 8 + chunk_size <= total_size
+            if audio_header["sample_count"] is None and block_align > 0:
+                audio_header["sample_count"] = chunk_size // block_align
+            break
+
+        # Chunks are padded to an even number of bytes
+        chunk_offset += 8 + chunk_size + chunk_size % 2
+        file.seek(start + chunk_offset)
+
+    if audio_header["sample_count"] is None:
+        audio_header["sample_count"] = 0
+
+    if audio_header["sample_rate"] > 0:
+        audio_header["duration"] = (
+            audio_header["sample_count"] / audio_header["sample_rate"]
+        )
+
+    return audio_header
+
+
+def is_audio_playable(audio_header: dict) -> bool:
+    """
+    False for files that would fail to convert or produce silence: not RIFF, empty or cut off part way through
+    """
+    return (
+        audio_header is not None
+        and audio_header["complete"]
+        and audio_header["sample_count"] > 0
+    )
+
+
+def at9_to_mp3(
+    converter_path: str,
+    input_file: str,
+    output_file: str,
+    print_output: bool,
+    preset: dict = AUDIO_PRESETS["mp3"],
+) -> float:
+    """
+    Converts a single at9 file to mp3 (or the format in preset) and returns the length of the audio in seconds
+    """
+
+    # Unique temp file so that conversions running at the same time don't clash
+    temp_handle, temp_file = tempfile.mkstemp(suffix=".wav")
+    os.close(temp_handle)
+
+    try:
+        # Convert at9 to wav
+        run_command([converter_path, input_file, temp_file], print_output)
+
+        # Wav to mp3. The old mp3 may be hard linked to other lines, so it is removed rather than overwritten.
+        make_dir(output_file)
+        delete_file(output_file)
+        audio = AudioSegment.from_wav(temp_file)
+        audio.export(
+            output_file,
+            format=preset["format"],
+            parameters=preset["parameters"],
+        )
+    finally:
+        # Delete wav
+        delete_file(temp_file)
+
+    return audio.duration_seconds
+
+
+def at9_to_mp3_ffmpeg(
+    ffmpeg_path: str,
+    input_file: str,
+    output_file: str,
+    preset: dict = AUDIO_PRESETS["mp3"],
+) -> float:
+    """
+    Converts a single at9 file to mp3 (or the format in preset) in one ffmpeg process and returns the length of the audio in seconds
+    """
+    make_dir(output_file)
+    delete_file(output_file)
+
+    # Slices of a .stream file are piped in rather than written to disk first
+    source_data = None
+    if split_stream_source(input_file) is not None:
+        source_data = read_source(input_file)
+        input_file = "pipe:0"
+
+    # -progress reports how much audio has been written, which gives the length without reading the file again
+    command_list = [
+        ffmpeg_path,
+        "-hide_banner",
+        "-nostdin",
+        "-nostats",
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        input_file,
+        "-vn",
+        "-f",
+        preset["format"],
+        *preset["parameters"],
+        "-progress",
+        "pipe:1",
+        output_file,
+    ]
+    result = subprocess.run(command_list, input=source_data, capture_output=True)
+
+    if result.returncode != 0:
+        delete_file(output_file)
+        raise RuntimeError(result.stderr.decode("utf-8", "replace").strip())
+
+    audio_seconds = 0.0
+    for progress_line in result.stdout.decode("utf-8", "replace").splitlines():
+        if progress_line.startswith("out_time_us=") and progress_line[12:].isdigit():
+            audio_seconds = int(progress_line[12:]) / 1000000
+
+    return audio_seconds
+
+
+def find_at9_files(sentences_root: str, max_files: int) -> list:
+    at9_files = []
+    for dirpath, dirnames, filenames in os.walk(sentences_root):
+        for filename in sorted(filenames):
+            if filename.endswith(".at9"):
+                at9_files.append(os.path.join(dirpath, filename))
+
+                if len(at9_files) >= max_files:
+                    return at9_files
+
+    return at9_files
+
+
+def benchmark_preset(backend, at9_files: list, output_folder: str) -> dict:
+    """
+    Converts at9_files one at a time so that the time is just the encode time of this preset
+    """
+    extension = backend.preset["extension"]
+    result = {"files": 0, "seconds": 0.0, "bytes": 0, "audio_seconds": 0.0}
+
+    for index, at9_file in enumerate(at9_files):
+        output_file = os.path.join(output_folder, f"{index}.{extension}")
+
+        start_time = time.perf_counter()
+        audio_seconds = backend.convert(at9_file, output_file)
+        result["seconds"] += time.perf_counter() - start_time
+
+        result["files"] += 1
+        result["bytes"] += os.path.getsize(output_file)
+        result["audio_seconds"] += audio_seconds
+
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Convert the audio files left in the journal, or compare the audio presets on a sample of the dumped audio"
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Compare the encode time and size of each preset instead of converting the journal",
+    )
+    parser.add_argument(
+        "--files",
+        type=int,
+        default=50,
+        help="Number of at9 files to convert with each preset when benchmarking",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default=settings.AUDIO_BACKEND,
+        help=f"Backend to convert with, one of {', '.join(AUDIO_BACKENDS.keys())}",
+    )
+    parser.add_argument(
+        "--preset",
+        type=str,
+        default=settings.AUDIO_PRESET,
+        help=f"Audio preset, one of {', '.join(AUDIO_PRESETS.keys())}",
+    )
+    parser.add_argument("--converter", type=str, default=settings.CONVERTER_PATH)
+    parser.add_argument("--workers", type=int, default=settings.AUDIO_WORKERS)
+    parser.add_argument(
+        "--journal",
+        type=str,
+        default=os.path.join(settings.CACHE_FOLDER, AUDIO_JOURNAL_FILENAME),
+    )
+    parser.add_argument(
+        "--ledger",
+        type=str,
+        default=(
+            os.path.join(settings.CACHE_FOLDER, AUDIO_LEDGER_FILENAME)
+            if settings.INCREMENTAL_BUILD
+            else ""
+        ),
+        help="Conversion ledger, or an empty string to convert everything",
+    )
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_presets(args.backend, args.converter, args.files)
+    else:
+        resume_conversion(args)
+
+
+def resume_conversion(args: argparse.Namespace) -> None:
+    convert_journal(
+        args.backend,
+        args.preset,
+        args.converter,
+        args.workers,
+        args.journal,
+        args.ledger if args.ledger != "" else None,
+    )
+
+
+def convert_journal(
+    backend_name: str,
+    preset_name: str,
+    converter_path: str,
+    workers: int,
+    journal_path: str,
+    ledger_path: str,
+) -> None:
+    """
+    Converts the jobs left in the journal and any that were handed off to it, waiting for the journal to be free first
+    """
+    if not file_exists(journal_path) and len(find_handoff_journals(journal_path)) == 0:
+        print("No audio left to convert")
+        return
+
+    backend = create_audio_backend(backend_name, converter_path, preset_name)
+    audio_converter = AudioConverter(
+        backend,
+        workers,
+        ledger_path,
+        journal_path,
+        wait_for_journal=True,
+    )
+    audio_converter.resume()
+    audio_converter.close()
+
+    print("Audio conversion finished")
+
+
+def benchmark_presets(backend_name: str, converter_path: str, max_files: int) -> None:
+    sentences_root = os.path.join(settings.UNPACKED_ROOT, "localized", "sentences")
+    at9_files = find_at9_files(sentences_root, max_files)
+    if len(at9_files) == 0:
+        print(
+            f"[ERROR] No at9 files found in {sentences_root}. Run 02_Dump_Language_Files.py with INCLUDE_AUDIO = True first"
+        )
+        exit()
+
+    print(f"Converting {len(at9_files)} files with each preset using {backend_name}")
+
+    with tempfile.TemporaryDirectory() as temp_folder:
+        for preset_name in AUDIO_PRESETS.keys():
+            backend = create_audio_backend(backend_name, converter_path, preset_name)
+            output_folder = os.path.join(temp_folder, preset_name)
+
+            try:
+                result = benchmark_preset(backend, at9_files, output_folder)
+            except Exception as e:
+                print(f"{preset_name}: failed ({e})")
+                continue
+
+            audio_minutes = max(result["audio_seconds"] / 60, 0.001)
+            print(
+                f"{preset_name}: {result['seconds']:.1f}s to encode ({1000 * result['seconds'] / result['files']:.0f}ms per file), "
+                f"{result['bytes'] / 1024:.0f}KB ({result['bytes'] / 1024 / audio_minutes:.0f}KB per minute of audio)"
+            )
+
+
+if __name__ == "__main__":
+    main()
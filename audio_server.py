@@ -0,0 +1,341 @@
+"""
+Local web server for the html transcript that converts each line's audio the first time it is played.
+
+Converting every line up front takes a long time and most of them are never played. With AUDIO_SERVER = True in settings.py,
+03_Build_Transcript.py skips the audio conversion and the transcript's audio links point at this server instead.
+Each line is read from the .stream file (using the index written by the sentence dumper) or from its .at9 file.
+Converted files are kept in CACHE_FOLDER, and the least recently played ones are deleted once they take up more than AUDIO_SERVER_CACHE_MB.
+Audio that was already converted into OUTPUT_FOLDER by an earlier build is served as it is.
+
+Run it with
+python audio_server.py
+and open one of the addresses that it prints.
+"""
+
+import os
+import glob
+import time
+import argparse
+import threading
+import posixpath
+import urllib.parse
+from collections import OrderedDict
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from pydecima.enums import ETextLanguages
+
+import settings
+from audio_converter import (
+    AT9_AUDIO_TYPES,
+    create_audio_backend,
+    get_audio_extension,
+    get_stream_source,
+    is_audio_playable,
+    scan_at9_header,
+)
+from scene_cache import get_audio_language
+from stream_index import get_stream_path, read_stream_index
+from support import delete_file, file_exists, make_dir
+
+AUDIO_SERVER_CACHE_FOLDER = "Audio_Server"
+
+
+class AudioCache:
+    """
+    Size-bounded disk cache of converted audio, keyed by the path of the audio within the transcript's audio folder.
+    Files are touched whenever they are played, so the least recently played ones are still the first to go after a restart.
+    """
+
+    def __init__(self, cache_folder: str, max_bytes: int) -> None:
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+        cached_files = []
+        for file_path in glob.glob(
+            os.path.join(cache_folder, "**", "*"), recursive=True
+        ):
+            if os.path.isfile(file_path):
+                if file_path.endswith(".tmp"):
+                    delete_file(file_path)
+                else:
+                    file_stat = os.stat(file_path)
+                    cached_files.append(
+                        (file_stat.st_mtime, file_path, file_stat.st_size)
+                    )
+
+        for _, file_path, file_size in sorted(cached_files):
+            self.entries[file_path] = file_size
+            self.total_bytes += file_size
+
+        self.evict()
+
+    def get_path(self, audio_key: str) -> str:
+        return os.path.join(self.cache_folder, *audio_key.split("/"))
+
+    def get(self, audio_key: str) -> str:
+        """
+        Path of the cached file, or None if it hasn't been converted (or has been evicted)
+        """
+        file_path = self.get_path(audio_key)
+
+        with self.lock:
+            if file_path not in self.entries:
+                return None
+
+            self.entries.move_to_end(file_path)
+
+        try:
+            os.utime(file_path)
+        except OSError:
+            return None
+
+        return file_path
+
+    def add(self, audio_key: str, temp_path: str) -> str:
+        """
+        Moves a newly converted file into the cache and deletes the least recently played files if the cache is too big
+        """
+        file_path = self.get_path(audio_key)
+        make_dir(file_path)
+        os.replace(temp_path, file_path)
+
+        with self.lock:
+            self.total_bytes -= self.entries.pop(file_path, 0)
+            self.entries[file_path] = os.path.getsize(file_path)
+            self.total_bytes += self.entries[file_path]
+            self.evict()
+
+        return file_path
+
+    def evict(self) -> None:
+        # The newest file is always kept, even if it is bigger than the whole cache, as it is about to be played
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            file_path, file_size = self.entries.popitem(last=False)
+            self.total_bytes -= file_size
+            delete_file(file_path)
+
+
+class AudioServer(ThreadingHTTPServer):
+    """
+    Serves OUTPUT_FOLDER, converting any audio that isn't there on request
+    """
+
+    def __init__(
+        self,
+        port: int,
+        output_folder: str,
+        unpacked_root: str,
+        backend,
+        audio_extension: str,
+        audio_cache: AudioCache,
+    ) -> None:
+        super().__init__(("localhost", port), AudioRequestHandler)
+        self.output_folder = output_folder
+        self.unpacked_root = unpacked_root
+        self.backend = backend
+        self.audio_extension = audio_extension
+        self.audio_cache = audio_cache
+        self.conversion_locks = {}
+        self.conversion_locks_lock = threading.Lock()
+
+    def get_conversion_lock(self, audio_key: str) -> threading.Lock:
+        """
+        One lock per file so that a line that is played twice in a row is only converted once
+        """
+        with self.conversion_locks_lock:
+            if audio_key not in self.conversion_locks:
+                self.conversion_locks[audio_key] = threading.Lock()
+
+            return self.conversion_locks[audio_key]
+
+    def convert_line_audio(self, audio_key: str) -> str:
+        """
+        Converts a line and adds it to the cache. Returns None if the line has no audio.
+        """
+        chapter, scene, language_folder, filename = audio_key.split("/")
+        line, extension = os.path.splitext(filename)
+        if extension != "." + self.audio_extension:
+            return None
+
+        source = find_audio_source(
+            self.unpacked_root, chapter, scene, language_folder, line
+        )
+        if source is None or not is_audio_playable(scan_at9_header(source)):
+            return None
+
+        temp_path = (
+            f"{self.audio_cache.get_path(audio_key)}.{threading.get_ident()}.tmp"
+        )
+        try:
+            self.backend.convert(source, temp_path)
+        except Exception:
+            delete_file(temp_path)
+            raise
+
+        return self.audio_cache.add(audio_key, temp_path)
+
+
+class AudioRequestHandler(SimpleHTTPRequestHandler):
+    def __init__(self, request, client_address, server: AudioServer) -> None:
+        super().__init__(
+            request, client_address, server, directory=server.output_folder
+        )
+
+    def do_GET(self) -> None:
+        audio_key = get_audio_key(self.path)
+        if audio_key is None or os.path.isfile(self.translate_path(self.path)):
+            super().do_GET()
+            return
+
+        try:
+            file_path = self.server.audio_cache.get(audio_key)
+            if file_path is None:
+                with self.server.get_conversion_lock(audio_key):
+                    file_path = self.server.audio_cache.get(audio_key)
+                    if file_path is None:
+                        start_time = time.perf_counter()
+                        file_path = self.server.convert_line_audio(audio_key)
+                        if file_path is not None:
+                            self.log_message(
+                                "Converted %s in %.2fs",
+                                audio_key,
+                                time.perf_counter() - start_time,
+                            )
+        except Exception as e:
+            self.log_error("Couldn't convert %s: %s", audio_key, e)
+            self.send_error(500, "Couldn't convert the audio", str(e))
+            return
+
+        if file_path is None:
+            self.send_error(404, f"No audio for {audio_key}")
+            return
+
+        self.send_file(file_path)
+
+    def send_file(self, file_path: str) -> None:
+        try:
+            file = open(file_path, "rb")
+        except OSError:
+            # Evicted by another request in the meantime
+            self.send_error(404, "Audio was removed from the cache")
+            return
+
+        with file:
+            self.send_response(200)
+            self.send_header("Content-Type", self.guess_type(file_path))
+            self.send_header("Content-Length", str(os.fstat(file.fileno()).st_size))
+            self.send_header("Cache-Control", "max-age=86400")
+            self.end_headers()
+            self.copyfile(file, self.wfile)
+
+
+def get_audio_key(url_path: str) -> str:
+    """
+    chapter/scene/language/line.extension for a request under /audio/, the same layout as the audio folder written by 03_Build_Transcript.py.
+    Returns None for anything else, including paths that try to leave the folder.
+    """
+    url_path = urllib.parse.unquote(urllib.parse.urlsplit(url_path).path)
+    url_path = posixpath.normpath(url_path)
+
+    path_parts = url_path.strip("/").split("/")
+    if len(path_parts) != 5 or path_parts[0] != "audio":
+        return None
+
+    if any(part in ("", ".", "..") or "\\" in part for part in path_parts):
+        return None
+
+    return "/".join(path_parts[1:])
+
+
+def get_text_language(language_folder: str) -> ETextLanguages:
+    for text_language in ETextLanguages:
+        if text_language.name.lower() == language_folder:
+            return text_language
+
+    return None
+
+
+def find_audio_source(
+    unpacked_root: str, chapter: str, scene: str, language_folder: str, line: str
+) -> str:
+    """
+    Slice of the scene's .stream file if the sentence dumper has indexed it, otherwise the .at9 file. None if neither exists.
+    """
+    text_language = get_text_language(language_folder)
+    if text_language is None:
+        return None
+
+    scene_folder = os.path.join(unpacked_root, "localized", "sentences", chapter, scene)
+
+    audio_language = get_audio_language(text_language)
+    if audio_language is not None:
+        stream_index = read_stream_index(scene_folder, audio_language)
+        if stream_index is not None and line in stream_index["lines"]:
+            start, size, sample_count, audio_type = stream_index["lines"][line]
+            if audio_type in AT9_AUDIO_TYPES:
+                return get_stream_source(
+                    get_stream_path(scene_folder, audio_language), start, size
+                )
+
+    at9_path = os.path.join(scene_folder, "sentences." + language_folder, line + ".at9")
+    if file_exists(at9_path):
+        return at9_path
+
+    return None
+
+
+def get_audio_server_url(port: int) -> str:
+    return f"http://localhost:{port}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Serve the html transcript and convert its audio when it is played"
+    )
+    parser.add_argument(
+        "--port", type=int, default=settings.AUDIO_SERVER_PORT, help="Port to listen on"
+    )
+    parser.add_argument(
+        "--cache-mb",
+        type=int,
+        default=settings.AUDIO_SERVER_CACHE_MB,
+        help="Maximum size of the converted audio cache in MB",
+    )
+    args = parser.parse_args()
+
+    audio_cache = AudioCache(
+        os.path.join(settings.CACHE_FOLDER, AUDIO_SERVER_CACHE_FOLDER),
+        args.cache_mb * 1024 * 1024,
+    )
+    backend = create_audio_backend(
+        settings.AUDIO_BACKEND, settings.CONVERTER_PATH, settings.AUDIO_PRESET
+    )
+    server = AudioServer(
+        args.port,
+        settings.OUTPUT_FOLDER,
+        settings.UNPACKED_ROOT,
+        backend,
+        get_audio_extension(settings.AUDIO_PRESET),
+        audio_cache,
+    )
+
+    print(
+        f"Audio cache: {len(audio_cache.entries)} files, {audio_cache.total_bytes / 1024 / 1024:.1f} MB"
+    )
+    for html_path in sorted(glob.glob(os.path.join(settings.OUTPUT_FOLDER, "*.html"))):
+        print(f"{get_audio_server_url(args.port)}/{os.path.basename(html_path)}")
+    print("Press Ctrl+C to stop")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+SQLite database of every line in the transcript, with a full text index on the target and native language text.
+
+Written by 03_Build_Transcript.py when WRITE_CORPUS_DB is enabled in settings.py.
+It can also be searched from the command line, e.g.
+python corpus_db.py "macchina"
+python corpus_db.py "machine" --native --limit 50
+"""
+
+import os
+import sqlite3
+import argparse
+
+import settings
+from support import delete_file, file_exists, make_dir
+
+CORPUS_COLUMNS = [
+    "category",
+    "chapter",
+    "scene",
+    "line",
+    "speaker",
+    "native_language",
+    "target_language",
+    "audio_duration",
+]
+
+
+def get_corpus_db_path(
+    output_folder: str, game_name: str, target_language_name: str
+) -> str:
+    db_path = os.path.join(
+        output_folder, f"{game_name}_{target_language_name}_Corpus.sqlite"
+    )
+
+    return db_path
+
+
+def create_corpus_db(db_path: str) -> sqlite3.Connection:
+    """
+    Creates an empty database, replacing any previous one.
+    Lines are numbered from 1 in the order that they are inserted, which is the same order as the other outputs.
+    """
+    make_dir(db_path)
+    delete_file(db_path)
+
+    connection = sqlite3.connect(db_path)
+    connection.execute("""
+        CREATE TABLE lines (
+            id INTEGER PRIMARY KEY,
+            category TEXT,
+            chapter TEXT,
+            scene TEXT,
+            line TEXT,
+            speaker TEXT,
+            native_language TEXT,
+            target_language TEXT,
+            audio_duration REAL
+        )
+        """)
+
+    # External content table, so the text is only stored once. Diacritics are kept as they change the meaning in a lot of languages.
+    connection.execute("""
+        CREATE VIRTUAL TABLE lines_fts USING fts5(
+            target_language,
+            native_language,
+            content='lines',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 0'
+        )
+        """)
+
+    return connection
+
+
+def insert_lines(connection: sqlite3.Connection, line_dicts: list) -> None:
+    """
+    audio_duration is left empty for lines extracted without audio
+    """
+    connection.executemany(
+        f"INSERT INTO lines ({', '.join(CORPUS_COLUMNS)}) VALUES ({', '.join('?' * len(CORPUS_COLUMNS))})",
+        [
+            [line_dict.get(column) for column in CORPUS_COLUMNS]
+            for line_dict in line_dicts
+        ],
+    )
+
+
+def finish_corpus_db(connection: sqlite3.Connection) -> None:
+    """
+    Builds the full text index and the lookup indexes in one go, which is much quicker than updating them for every insert
+    """
+    connection.execute("INSERT INTO lines_fts(lines_fts) VALUES('rebuild')")
+    connection.execute("CREATE INDEX lines_scene ON lines (category, chapter, scene)")
+    connection.execute("CREATE INDEX lines_speaker ON lines (speaker)")
+    connection.commit()
+    connection.close()
+
+
+def write_corpus_db(line_dicts: list, db_path: str) -> None:
+    print("Writing file: " + db_path)
+    connection = create_corpus_db(db_path)
+    insert_lines(connection, line_dicts)
+    finish_corpus_db(connection)
+
+
+def open_corpus_db(db_path: str) -> sqlite3.Connection:
+    """
+    Opens an existing database. Returns None if it doesn't exist.
+    """
+    if not file_exists(db_path):
+        return None
+
+    connection = sqlite3.connect(db_path)
+    connection.row_factory = sqlite3.Row
+
+    return connection
+
+
+def count_lines(connection: sqlite3.Connection) -> int:
+    return connection.execute("SELECT COUNT(*) FROM lines").fetchone()[0]
+
+
+def search_lines(
+    connection: sqlite3.Connection,
+    search_text: str,
+    column: str = "target_language",
+    limit: int = None,
+):
+    """
+    Finds lines containing every word of search_text in the given column, in transcript order.
+    Each word is quoted, so punctuation and FTS5 operators in the search are treated as plain text.
+    The lines are fetched as they are iterated over, so the caller can stop at the first one it needs.
+    """
+    match_words = [
+        '"' + word.replace('"', '""') + '"' for word in search_text.split() if word
+    ]
+    if len(match_words) == 0:
+        return
+
+    query = """
+        SELECT lines.*
+        FROM lines_fts
+        JOIN lines ON lines.id = lines_fts.rowid
+        WHERE lines_fts MATCH ?
+        ORDER BY lines.id
+    """
+    parameters = [f"{column} : ({' '.join(match_words)})"]
+
+    if limit is not None:
+        query += " LIMIT ?"
+        parameters.append(limit)
+
+    yield from connection.execute(query, parameters)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Search the transcript database written by 03_Build_Transcript.py"
+    )
+    parser.add_argument("search_text", type=str, help="Word(s) to search for")
+    parser.add_argument(
+        "--native",
+        action="store_true",
+        help="Search the native language text instead of the target language",
+    )
+    parser.add_argument(
+        "--limit", type=int, default=20, help="Maximum number of lines to show"
+    )
+    args = parser.parse_args()
+
+    db_path = get_corpus_db_path(
+        settings.OUTPUT_FOLDER, settings.DECIMA_VERSION, settings.TARGET_LANG.name
+    )
+    connection = open_corpus_db(db_path)
+    if connection is None:
+        print(
+            f"[ERROR] {db_path} does not exist. Set WRITE_CORPUS_DB = True in settings.py and run 03_Build_Transcript.py"
+        )
+        exit()
+
+    column = "native_language" if args.native else "target_language"
+    result_count = 0
+    for result in search_lines(connection, args.search_text, column, args.limit):
+        print(f"{result['category']} / {result['chapter']} / {result['scene']}")
+        print(f"    {result['speaker']}: {result['target_language']}")
+        print(f"    {result['native_language']}")
+        result_count += 1
+
+    connection.close()
+
+    print(f"{result_count} line(s) found")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+"""
+Disk cache of parsed sentences.core files.
+
+pydecima is slow at decoding the binary object graph so each scene is decoded once, normalised into plain python
+data and stored as json keyed by the hash of the .core file. The transcript builder and the sentence dumper both
+read scenes through load_scene so a scene is only ever decoded once between them.
+"""
+
+import os
+import json
+import binascii
+
+import pydecima
+from pydecima.enums import EAudioLanguages, ETextLanguages
+from pydecima.resources import (
+    LocalizedSimpleSoundResource,
+    LocalizedTextResource,
+    Resource,
+    SentenceGroupResource,
+    SentenceResource,
+)
+from pydecima.resources.structs.Ref import Ref
+
+from support import file_exists, get_file_stat, hash_file, write_json
+
+# Text languages whose audio language has a different name
+AUDIO_LANGUAGE_LOOKUP = {
+    "Portuguese": EAudioLanguages.Portugese,
+    "LatinAmericanSpanish": EAudioLanguages.LatAmSp,
+    "BrazilianPortuguese": EAudioLanguages.LatAmPor,
+}
+
+# Bump this whenever the structure returned by normalise_scene changes so that old cache files are ignored
+SCENE_CACHE_VERSION = 3
+
+# Objects loaded from other .core files (e.g. voices), shared by every scene decoded in this process
+external_objects = {}
+
+# Resolved cross-file references keyed by uuid, along with how often they were reused
+resolved_references = {}
+reference_stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+
+
+def load_scene(file_path: str, cache_folder: str = None) -> dict:
+    """
+    Returns the normalised form of a sentences.core file, decoding it with pydecima only if it isn't already cached.
+    Caching is skipped if cache_folder is None.
+    """
+    if cache_folder is None:
+        return normalise_scene(file_path)
+
+    file_hash = hash_file(file_path)
+    cache_path = get_cache_path(cache_folder, file_hash)
+
+    # Speaker names are copied into the scene, so it is decoded again if any of its voice files have changed since
+    scene = read_cached_scene(cache_path)
+    if scene is None or not are_voices_current(scene):
+        scene = normalise_scene(file_path, cache_folder)
+        write_cached_scene(cache_path, scene)
+
+    return scene
+
+
+def get_cache_path(cache_folder: str, file_hash: str) -> str:
+    cache_path = os.path.join(cache_folder, "scenes", file_hash + ".json")
+
+    return cache_path
+
+
+def read_cached_scene(cache_path: str) -> dict:
+    if not file_exists(cache_path):
+        return None
+
+    try:
+        with open(cache_path, "r", encoding="utf-8") as file:
+            scene = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if (
+        scene.get("version") != SCENE_CACHE_VERSION
+        or scene.get("decima_version") != pydecima.reader.decima_version.value
+    ):
+        return None
+
+    return scene
+
+
+def write_cached_scene(cache_path: str, scene: dict) -> None:
+    write_json(cache_path, scene, ensure_ascii=False, separators=(",", ":"))
+
+
+def normalise_scene(file_path: str, cache_folder: str = None) -> dict:
+    """
+    Decodes a sentences.core file and keeps only what the scripts need:
+    sentences: name, text in every language, voice reference, sound type and stream offsets
+    voices: the reference path and speaker's name in every language for each voice used in the scene,
+    along with the size and modification time of the voice's file (file_stat) if it is shared with other scenes
+    groups: the sentence groups and the order of their sentences
+    orphans: text in the file that isn't used by any sentence group
+    """
+    scene_dict = {}
+    pydecima.reader.read_objects(file_path, scene_dict)
+
+    # Following a reference can load other .core files into the dict, so keep a copy of what was in this file
+    file_objects = scene_dict.copy()
+
+    # Many lines share a speaker, so each voice is only followed once
+    voices = {}
+    sentences = []
+    for resource in file_objects.values():
+        if isinstance(resource, SentenceResource):
+            sentences.append(
+                normalise_sentence(resource, scene_dict, voices, cache_folder)
+            )
+
+    groups = []
+    visited_uuids = set()
+    for resource in file_objects.values():
+        if isinstance(resource, SentenceGroupResource):
+            sentence_uuids = [uuid_to_str(ref.hash) for ref in resource.sentences]
+            groups.append(
+                {
+                    "name": resource.name,
+                    "type": resource.type,
+                    "order": resource.sentence_type.name,
+                    "sentences": sentence_uuids,
+                }
+            )
+            visited_uuids.update(sentence_uuids)
+
+    for sentence in sentences:
+        if sentence["uuid"] in visited_uuids and sentence["text_uuid"] is not None:
+            visited_uuids.add(sentence["text_uuid"])
+
+    orphans = []
+    for resource in file_objects.values():
+        if (
+            isinstance(resource, LocalizedTextResource)
+            and uuid_to_str(resource.uuid) not in visited_uuids
+        ):
+            orphans.append(list(resource.language))
+
+    scene = {
+        "version": SCENE_CACHE_VERSION,
+        "decima_version": pydecima.reader.decima_version.value,
+        "sentences": sentences,
+        "voices": voices,
+        "groups": groups,
+        "orphans": orphans,
+    }
+
+    return scene
+
+
+def normalise_sentence(
+    resource: SentenceResource, scene_dict: dict, voices: dict, cache_folder: str
+) -> dict:
+    text = follow_reference(resource.text, scene_dict)
+
+    sentence = {
+        "uuid": uuid_to_str(resource.uuid),
+        "type": resource.type,
+        "name": resource.name,
+        "text_uuid": uuid_to_str(text.uuid) if text is not None else None,
+        "text": list(text.language) if text is not None else None,
+        "voice": normalise_voice(resource, scene_dict, voices, cache_folder),
+        "sound": normalise_sound(resource, scene_dict),
+    }
+
+    return sentence
+
+
+def normalise_voice(
+    resource: SentenceResource, scene_dict: dict, voices: dict, cache_folder: str
+) -> str:
+    """
+    Adds the sentence's voice to the voices table if it isn't already there and returns its uuid.
+    The speaker's name is stored as None if it can't be resolved.
+    """
+    if resource.voice.type == 0:
+        return None
+
+    voice_uuid = uuid_to_str(resource.voice.hash)
+    if voice_uuid not in voices:
+        voices[voice_uuid] = resolve_voice(resource.voice, scene_dict, cache_folder)
+
+    return voice_uuid
+
+
+def resolve_voice(voice_ref: Ref, scene_dict: dict, cache_folder: str) -> dict:
+    """
+    Voices live in their own .core files and are shared by hundreds of scenes.
+    Checks the in-process cache, then the disk cache, before reading the voice's file.
+    """
+    voice_path = getattr(voice_ref, "path", None)
+
+    # Voices defined within the scene itself aren't shared with anything else
+    if voice_ref.hash in scene_dict or voice_path is None:
+        return {"path": voice_path, "text": follow_voice_text(voice_ref, scene_dict)}
+
+    voice_uuid = uuid_to_str(voice_ref.hash)
+    if voice_uuid in resolved_references:
+        reference_stats["hits"] += 1
+        return resolved_references[voice_uuid]
+
+    voice = read_cached_reference(cache_folder, voice_uuid, voice_path)
+    if voice is not None:
+        reference_stats["disk_hits"] += 1
+    else:
+        reference_stats["misses"] += 1
+        voice = {
+            "path": voice_path,
+            "text": follow_voice_text(voice_ref, scene_dict),
+            "file_stat": get_reference_file_stat(voice_path),
+        }
+        write_cached_reference(cache_folder, voice_uuid, voice)
+
+    resolved_references[voice_uuid] = voice
+
+    return voice
+
+
+def follow_voice_text(voice_ref: Ref, scene_dict: dict) -> list:
+    try:
+        voice_name = follow_reference(
+            follow_reference(voice_ref, scene_dict).text, scene_dict
+        )
+        voice_text = list(voice_name.language)
+    except:
+        voice_text = None
+
+    return voice_text
+
+
+def follow_reference(ref: Ref, scene_dict: dict) -> Resource:
+    """
+    Same as Ref.follow, except that objects from other .core files are kept in external_objects.
+    Each referenced file is therefore only read once per process, rather than once per scene.
+    """
+    if ref.type == 0:
+        return None
+
+    if ref.hash in scene_dict:
+        return scene_dict[ref.hash]
+
+    return ref.follow(external_objects)
+
+
+def get_reference_file_stat(voice_path: str) -> list:
+    """
+    Size and modification time of a referenced .core file, used to spot when a cached reference is out of date
+    """
+    full_path = os.path.join(pydecima.reader.game_root, voice_path) + ".core"
+
+    return get_file_stat(full_path)
+
+
+def read_cached_reference(cache_folder: str, voice_uuid: str, voice_path: str) -> dict:
+    if cache_folder is None:
+        return None
+
+    cache_path = os.path.join(cache_folder, "references", voice_uuid + ".json")
+    if not file_exists(cache_path):
+        return None
+
+    try:
+        with open(cache_path, "r", encoding="utf-8") as file:
+            cached_reference = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if cached_reference.get("file_stat") != get_reference_file_stat(voice_path):
+        return None
+
+    voice = {
+        "path": cached_reference["path"],
+        "text": cached_reference["text"],
+        "file_stat": cached_reference["file_stat"],
+    }
+
+    return voice
+
+
+def write_cached_reference(cache_folder: str, voice_uuid: str, voice: dict) -> None:
+    if cache_folder is None:
+        return
+
+    cached_reference = {
+        "path": voice["path"],
+        "text": voice["text"],
+        "file_stat": voice["file_stat"],
+    }
+
+    cache_path = os.path.join(cache_folder, "references", voice_uuid + ".json")
+    write_json(cache_path, cached_reference, ensure_ascii=False, separators=(",", ":"))
+
+
+def get_voice_file_stats(scene: dict) -> dict:
+    """
+    Path -> [size, modification time] of every shared voice file that the scene's speaker names were read from
+    """
+    voice_file_stats = {
+        voice["path"]: voice["file_stat"]
+        for voice in scene["voices"].values()
+        if "file_stat" in voice
+    }
+
+    return voice_file_stats
+
+
+def are_voices_current(scene: dict) -> bool:
+    """
+    False if any of the voice files that the scene's speaker names came from have changed since the scene was decoded
+    """
+    for voice_path, file_stat in get_voice_file_stats(scene).items():
+        if get_reference_file_stat(voice_path) != file_stat:
+            return False
+
+    return True
+
+
+def get_reference_stats() -> dict:
+    """
+    Number of cross-file references served from memory, served from disk or read from the game files in this process
+    """
+    return reference_stats.copy()
+
+
+def normalise_sound(resource: SentenceResource, scene_dict: dict) -> dict:
+    """
+    Audio type and the [start, size, sample count] of the line in each language's .stream file, None where a language has no audio
+    """
+    try:
+        sound = follow_reference(resource.sound, scene_dict)
+    except:
+        return None
+
+    if not isinstance(sound, LocalizedSimpleSoundResource):
+        return None
+
+    sound_info = []
+    for info in sound.sound_info:
+        if info is None:
+            sound_info.append(None)
+        else:
+            sound_info.append([info.start, info.size_1, info.sample_count])
+
+    normalised_sound = {
+        "audio_type": sound.audio_type,
+        "sample_rate": sound.sample_rate,
+        "sound_info": sound_info,
+    }
+
+    return normalised_sound
+
+
+def get_voice_name(scene: dict, voice_uuid: str, language: ETextLanguages) -> str:
+    """
+    Speaker's name in the requested language, falling back to English. Returns None if the voice couldn't be resolved.
+    """
+    if voice_uuid is None or scene["voices"][voice_uuid]["text"] is None:
+        return None
+
+    voice_text = scene["voices"][voice_uuid]["text"]
+
+    voice_str = ""
+    if voice_text[language] != "":
+        voice_str = voice_text[language]
+    elif voice_text[ETextLanguages.English] != "":
+        voice_str = voice_text[ETextLanguages.English]
+
+    return voice_str
+
+
+def get_audio_language(text_language: ETextLanguages) -> EAudioLanguages:
+    """
+    Audio language that matches a text language, used to index sound_info. Returns None if the language has no audio.
+    """
+    if hasattr(EAudioLanguages, text_language.name):
+        return getattr(EAudioLanguages, text_language.name)
+
+    return AUDIO_LANGUAGE_LOOKUP.get(text_language.name)
+
+
+def uuid_to_str(uuid: bytes) -> str:
+    return binascii.hexlify(uuid).decode("ASCII")
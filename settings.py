@@ -5,7 +5,7 @@ Game root is the "Packed_DX12" folder within your game installation
 
 Languages can be one of: English, French, Spanish, German, Italian, Dutch, Portuguese, TraditionalChinese, Korean, Russian, Polish, Danish, Finnish, Norwegian, Swedish, Japanese, LatinAmericanSpanish, BrazilianPortuguese, Turkish, Arabic, SimplifiedChinese
 Language name needs to be prefixed with "ETextLanguages." e.g. NATIVE_LANG = ETextLanguages.English
-Include audio can be True or False. True if you have extracted the data, False if you haven't. Script runs much faster if set to False.
+Include audio can be True or False. True if you have extracted the data, False if you haven't. Script runs much faster if set to False. When True, the length of each line's audio is also read from its header and saved with the subtitles.
 """
 
 from pydecima.enums import ETextLanguages
@@ -18,6 +18,41 @@ TARGET_LANG = ETextLanguages.Italian
 INCLUDE_AUDIO = True
 
 
+"""
+Performance settings for the build transcript script.
+EXTRACTION_WORKERS is the number of processes used to read the scene files. 1 reads them one at a time (the original behaviour), 0 uses one process per CPU core. The output is identical either way.
+INCREMENTAL_BUILD should be True or False. When True, a manifest of every scene is kept in CACHE_FOLDER and only scenes that have been added or changed since the last run are read again. A ledger of converted audio is also kept so that only missing or out of date mp3 files are converted.
+EXTRACT_ALL_LANGUAGES should be True or False. When True, the text for every language is saved in the INCREMENTAL_BUILD manifest in CACHE_FOLDER and NATIVE_LANG/TARGET_LANG can be changed without reading the scenes again (unless audio is included or STREAMING_BUILD is True).
+STREAMING_BUILD should be True or False. When True, each scene is written straight to the outputs instead of every line being held in memory at once. The manifest isn't used in this mode.
+STREAMING_SINKS is the list of outputs written by a streaming build. It can contain "parquet", "xlsx", "html", "sqlite", "csv" and "jsonl". 04_Create_Anki_Deck.py reads the parquet file if it exists, otherwise the xlsx.
+WRITE_CORPUS_DB should be True or False. When True, a searchable SQLite database of every line is also written (add "sqlite" to STREAMING_SINKS for streaming builds). Search it with python corpus_db.py "word".
+TRANSCRIPT_VARIANTS is the list of html transcripts that are written. It can contain "QuestsOnly", "Toggles", "AlwaysShowNative" and "NoNL". They are all written in one go, but removing the ones you don't use saves time and disk space.
+AUDIO_WORKERS is the number of audio files converted at the same time while the scenes are being extracted. 0 uses one per CPU core.
+AUDIO_BACKEND is how the audio is converted. "vgaudio" uses VGAudioCli (CONVERTER_PATH) and then FFMPEG, which only works on Windows. "ffmpeg" uses FFMPEG 4.1 or newer for the whole conversion, which is quicker and works on any OS.
+AUDIO_PRESET is the format of the sentence audio. "mp3" is the original format, "mp3_vbr" is a smaller mp3, "opus" is smaller again and "speech" is low quality mono opus for the smallest files. Opus files can't be played by older versions of Safari. Run python audio_converter.py --benchmark to compare them.
+AUDIO_FROM_STREAM should be True or False. When True, the audio is read straight from the .stream file for each scene and 02_Dump_Language_Files.py doesn't write an .at9 file for every line.
+AUDIO_IN_BACKGROUND should be True or False. When True, the transcript is written without waiting for the audio, which carries on converting in a separate process. Either way, if the audio conversion is stopped it continues where it left off the next time the transcript is built or when python audio_converter.py is run.
+AUDIO_SERVER should be True or False. When True, no audio is converted by the build transcript script. Instead, run python audio_server.py and each line is converted the first time it is played in the html transcript.
+AUDIO_SERVER_PORT is the port that audio_server.py listens on. The html transcript has to be built again if it is changed.
+AUDIO_SERVER_CACHE_MB is how much disk space audio_server.py keeps converted audio in. The least recently played files are deleted first.
+"""
+EXTRACTION_WORKERS = 0
+INCREMENTAL_BUILD = True
+EXTRACT_ALL_LANGUAGES = False
+STREAMING_BUILD = False
+STREAMING_SINKS = ["parquet", "xlsx", "html"]
+WRITE_CORPUS_DB = False
+TRANSCRIPT_VARIANTS = ["QuestsOnly", "Toggles", "AlwaysShowNative", "NoNL"]
+AUDIO_WORKERS = 0
+AUDIO_BACKEND = "vgaudio"
+AUDIO_PRESET = "mp3"
+AUDIO_FROM_STREAM = False
+AUDIO_IN_BACKGROUND = False
+AUDIO_SERVER = False
+AUDIO_SERVER_PORT = 8000
+AUDIO_SERVER_CACHE_MB = 1000
+
+
 """
 These only need to be set if you want to generate Anki decks
 ANKI_MAX_CARDS is the number of cards in the Anki deck. I recommend that you don't go above around 1000, otherwise the script will take a while to run.
@@ -68,6 +103,7 @@ You shouldn't need to change the following unless you are making changes to the
 """
 UNPACKED_ROOT = r"unpacked_files"
 OUTPUT_FOLDER = r"output"
+CACHE_FOLDER = r"cache"
 CONVERTER_PATH = r"tools\vgaudio\VGAudioCli.exe"
 HTML_TEMPLATE_PATH = r"html_source\template_minimised.html"
 SENTENCE_DUMPER_PATH = r"tools\decima-scripts\sentence_dumper"
@@ -0,0 +1,177 @@
+"""
+Index of where each line's audio is in a scene's .stream file.
+
+The sentence dumper writes sentences.<language>.index.json next to sentences.<language>.stream for each scene, so the
+audio for any line can be read with one seek into the .stream file, without the .core file or a dumped copy of the audio.
+It can also be used from the command line, e.g.
+python stream_index.py "C:\\HZD\\localized\\sentences\\mq01_papooserider\\mq01_papooserider_00_intro" mq01_00_aloy_001 -l Italian
+"""
+
+import os
+import json
+import argparse
+
+from pydecima.enums import EAudioLanguages
+
+from support import file_exists, get_file_stat, write_json
+
+# Bump this whenever the structure of the index changes so that old index files are ignored
+STREAM_INDEX_VERSION = 1
+
+AUDIO_TYPE_EXTENSIONS = {
+    0x09: "at9",
+    0x0B: "mp3",
+    0x0D: "at9",
+    0x0F: "aac",  # ps4-only
+}
+
+
+def get_audio_type_extension(audio_type: int) -> str:
+    return AUDIO_TYPE_EXTENSIONS.get(audio_type, "vgmstream")
+
+
+def get_stream_path(scene_folder: str, language: EAudioLanguages) -> str:
+    return os.path.join(scene_folder, "sentences." + language.name.lower() + ".stream")
+
+
+def get_stream_index_path(scene_folder: str, language: EAudioLanguages) -> str:
+    return os.path.join(
+        scene_folder, "sentences." + language.name.lower() + ".index.json"
+    )
+
+
+def create_stream_index(
+    scene: dict, stream_path: str, language: EAudioLanguages
+) -> dict:
+    """
+    Builds the index from a scene loaded by scene_cache.load_scene.
+    Each line is stored as [start, size, sample count, audio type]. Lines with no audio in this language are left out.
+    """
+    lines = {}
+    for sentence in scene["sentences"]:
+        sound = sentence["sound"]
+        if sound is None or sound["sound_info"][language] is None:
+            continue
+
+        start, size, sample_count = sound["sound_info"][language]
+        lines[sentence["name"]] = [start, size, sample_count, sound["audio_type"]]
+
+    stream_index = {
+        "version": STREAM_INDEX_VERSION,
+        "language": language.name,
+        "stream_stat": get_file_stat(stream_path),
+        "lines": lines,
+    }
+
+    return stream_index
+
+
+def write_stream_index(
+    scene: dict, scene_folder: str, language: EAudioLanguages
+) -> bool:
+    """
+    Writes the index for a scene. Returns False if the scene has no .stream file in this language.
+    """
+    stream_path = get_stream_path(scene_folder, language)
+    if not file_exists(stream_path):
+        return False
+
+    stream_index = create_stream_index(scene, stream_path, language)
+
+    index_path = get_stream_index_path(scene_folder, language)
+    write_json(index_path, stream_index, separators=(",", ":"))
+
+    return True
+
+
+def read_stream_index(scene_folder: str, language: EAudioLanguages) -> dict:
+    """
+    Loads the index for a scene. Returns None if it doesn't exist or the .stream file has changed since it was written.
+    """
+    index_path = get_stream_index_path(scene_folder, language)
+    if not file_exists(index_path):
+        return None
+
+    try:
+        with open(index_path, "r", encoding="utf-8") as file:
+            stream_index = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if stream_index.get("version") != STREAM_INDEX_VERSION or stream_index.get(
+        "stream_stat"
+    ) != get_file_stat(get_stream_path(scene_folder, language)):
+        return None
+
+    return stream_index
+
+
+def read_line_audio(
+    scene_folder: str,
+    language: EAudioLanguages,
+    line_name: str,
+    stream_index: dict = None,
+) -> tuple:
+    """
+    Returns (audio data, file extension) for a line, or None if the line has no audio or there is no up to date index.
+    Pass in stream_index if it has already been read to save loading it again.
+    """
+    if stream_index is None:
+        stream_index = read_stream_index(scene_folder, language)
+
+    if stream_index is None or line_name not in stream_index["lines"]:
+        return None
+
+    start, size, sample_count, audio_type = stream_index["lines"][line_name]
+
+    with open(get_stream_path(scene_folder, language), "rb") as file:
+        file.seek(start)
+        audio_data = file.read(size)
+
+    return audio_data, get_audio_type_extension(audio_type)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Extract the audio for one line using the index written by the sentence dumper"
+    )
+    parser.add_argument(
+        "scene_folder", type=str, help="Folder containing the scene's sentences.core"
+    )
+    parser.add_argument("line_name", type=str, help="Name of the line in the scene")
+    parser.add_argument(
+        "-l",
+        "--language",
+        type=str,
+        default="English",
+        choices=[language.name for language in EAudioLanguages],
+        help="Audio language",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="File to write the audio to. Defaults to [line_name].[extension] in the current folder",
+    )
+    args = parser.parse_args()
+
+    language = getattr(EAudioLanguages, args.language)
+    line_audio = read_line_audio(args.scene_folder, language, args.line_name)
+    if line_audio is None:
+        print(
+            f"[ERROR] No audio found for {args.line_name}. Check that the sentence dumper has been run on this scene since the .stream file was extracted."
+        )
+        exit()
+
+    audio_data, extension = line_audio
+    output_path = args.output or args.line_name + "." + extension
+
+    with open(output_path, "wb") as file:
+        file.write(audio_data)
+
+    print(f"Written {len(audio_data)} bytes to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
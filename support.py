@@ -1,6 +1,15 @@
 import os
+import json
+import hashlib
+import contextlib
 import subprocess
 import shutil
+import threading
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
 
 
 def run_command(command_list: list, print_output: bool = True) -> None:
@@ -35,6 +44,87 @@ def copy_file(source_path, target_path):
         print(f"Error: {e}")
 
 
+def link_file(source_path: str, target_path: str) -> None:
+    """
+    Hard links target_path to source_path, replacing anything already there. Falls back to a copy if the file system doesn't support links.
+    """
+    make_dir(target_path)
+    temp_path = f"{target_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    try:
+        os.link(source_path, temp_path)
+    except OSError:
+        shutil.copyfile(source_path, temp_path)
+
+    os.replace(temp_path, target_path)
+
+
+@contextlib.contextmanager
+def open_atomic(target_path: str):
+    """
+    Opens a temporary file for writing that replaces target_path once it has been written, so an interrupted run can't leave half a file behind.
+    The temporary file is per process so that parallel workers writing the same file can't clash.
+    """
+    make_dir(target_path)
+    temp_path = f"{target_path}.{os.getpid()}.tmp"
+
+    with open(temp_path, "w", encoding="utf-8") as file:
+        yield file
+
+    os.replace(temp_path, target_path)
+
+
+def write_json(target_path: str, data, **json_options) -> None:
+    """
+    Writes data to target_path with open_atomic. json_options are passed to json.dump.
+    """
+    with open_atomic(target_path) as file:
+        json.dump(data, file, **json_options)
+
+
+def get_file_stat(path: str) -> list:
+    """
+    [size, modification time], used to spot when a file has changed. None if the file doesn't exist.
+    """
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        return None
+
+    return [file_stat.st_size, file_stat.st_mtime_ns]
+
+
+def lock_file(lock_path: str):
+    """
+    Takes an exclusive lock on lock_path without waiting, creating the file if needed.
+    Returns the open file, which holds the lock until unlock_file is called or the process exits, or None if another process holds it.
+    """
+    make_dir(lock_path)
+    lock = open(lock_path, "a+")
+
+    try:
+        if os.name == "nt":
+            lock.seek(0)
+            msvcrt.locking(lock.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None
+
+    return lock
+
+
+def unlock_file(lock) -> None:
+    if os.name == "nt":
+        lock.seek(0)
+        msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    lock.close()
+
+
 def delete_file(filename: str) -> bool:
     if not file_exists(filename):
         return False
@@ -46,21 +136,33 @@ def delete_file(filename: str) -> bool:
         return False
 
 
-def folder_exists(path: str) -> bool:
-    folder, file = os.path.split(path)
-    return os.path.isdir(folder)
-
-
 def make_dir(path: str) -> None:
     folder, file = os.path.split(path)
-    if not folder_exists(folder):
-        os.makedirs(folder)
+    if folder != "" and not os.path.isdir(folder):
+        # exist_ok as parallel workers can race to create the same folder
+        os.makedirs(folder, exist_ok=True)
 
 
 def file_exists(file_path: str) -> bool:
     return os.path.exists(file_path)
 
 
+def hash_file(file_path: str) -> str:
+    """Content hash of a file, read in blocks so that large files don't have to fit in memory"""
+    file_hash = hashlib.blake2b(digest_size=16)
+
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+
+def hash_bytes(data: bytes) -> str:
+    """Same hash as hash_file, for data that is already in memory"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
 def get_script_dir() -> str:
     return os.path.dirname(os.path.abspath(__file__))
 
@@ -1,10 +1,16 @@
 from typing import Optional
 import pydecima
 import os
+import sys
 import argparse
 
 from pydecima.enums import EAudioLanguages, ETextLanguages
-from pydecima.resources import LocalizedTextResource, SentenceGroupResource, SentenceResource, ObjectCollection
+from pydecima.resources import LocalizedTextResource, ObjectCollection
+
+# scene_cache and stream_index live in the root of the translate_horizon_zero_dawn repository
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+import scene_cache
+import stream_index
 
 
 def yaml_one_line_string(text: str, prefer_quotes=False):
@@ -51,56 +57,46 @@ def dump_simpletext(filename, language: ETextLanguages):
         out_file.write(out)
 
 
-def dump_sentences(filename, language: ETextLanguages):
-    script_objects = {}
-    pydecima.reader.read_objects(filename, script_objects)
+def dump_sentences(filename, language: ETextLanguages, cache_folder: Optional[str] = None):
+    scene = scene_cache.load_scene(filename, cache_folder)
 
     out = ''
-    visited_uuids = set()
-    file_objects = script_objects.copy()
+    sentences = {sent['uuid']: sent for sent in scene['sentences']}
 
-    groups = [n for n in script_objects.values() if isinstance(n, SentenceGroupResource)]
-    groups.sort(key=lambda group: group.name)
+    groups = sorted(scene['groups'], key=lambda group: group['name'])
 
     for x in groups:
-        out += f'- {x.name}: # {x.type}\n'
-        out += f'   Order: {x.sentence_type.name}\n'
-        for sentence in x.sentences:
-            sent = sentence.follow(script_objects)
-            visited_uuids.add(sent.uuid)
-            out += f'   {yaml_one_line_string(sent.name)}: # {sent.type}\n'
-            text = sent.text.follow(script_objects)
-            if text is not None:
-                visited_uuids.add(text.uuid)
-            voice_name = sent.voice.follow(script_objects).text.follow(script_objects)
-            voice_str = '<No voice name>'
-            if voice_name.language[language] != '':
-                voice_str = voice_name.language[language]
-            elif voice_name.language[ETextLanguages.English] != '':
-                voice_str = voice_name.language[ETextLanguages.English]
+        out += f'- {x["name"]}: # {x["type"]}\n'
+        out += f'   Order: {x["order"]}\n'
+        for sentence_uuid in x['sentences']:
+            # Groups can refer to sentences in other files, which aren't part of this scene's cache
+            if sentence_uuid not in sentences:
+                out += f'   # Sentence {sentence_uuid} is in another file\n'
+                continue
+            sent = sentences[sentence_uuid]
+            out += f'   {yaml_one_line_string(sent["name"])}: # {sent["type"]}\n'
+            text = sent['text']
+            voice_str = scene_cache.get_voice_name(scene, sent['voice'], language)
+            if voice_str is None or voice_str == '':
+                voice_str = '<No voice name>'
             out += '    {}: {}\n'.format(
                 yaml_one_line_string(voice_str),
-                yaml_one_line_string(text.language[language], True) if sent.text.type != 0 else '<No subtitle>'
+                yaml_one_line_string(text[language], True) if text is not None else '<No subtitle>'
             )
         out += '\n'
 
-    found_orphans = False
-    for t in file_objects.values():
-        if t.type in ['SentenceResource', 'LocalizedTextResource'] and t.uuid not in visited_uuids:
-            if not found_orphans:
-                found_orphans = True
-                out += '- Orphaned data:\n'
-            assert(t.type == 'LocalizedTextResource')
-            t: LocalizedTextResource
-            loc = t.language[language] if t.language[language] != "" else t.language[ETextLanguages.English]
-            out += f'  - {yaml_one_line_string(loc, True)}\n'
+    if len(scene['orphans']) > 0:
+        out += '- Orphaned data:\n'
+    for t in scene['orphans']:
+        loc = t[language] if t[language] != "" else t[ETextLanguages.English]
+        out += f'  - {yaml_one_line_string(loc, True)}\n'
 
     with open(filename + '.yml', 'w', encoding='utf8') as out_file:
         out_file.write(out)
 
 
 def dump_file(filename: str, do_audio: bool, do_text: bool,
-              audio_lang: EAudioLanguages, text_lang: ETextLanguages):
+              audio_lang: EAudioLanguages, text_lang: ETextLanguages, cache_folder: Optional[str] = None):
     try:
         if os.stat(filename).st_size > 0:  # Ignore empty files
             f = os.path.split(filename)[-1]
@@ -111,9 +107,12 @@ def dump_file(filename: str, do_audio: bool, do_text: bool,
             elif f == "sentences.core":
                 print(filename)
                 if do_text:
-                    dump_sentences(filename, text_lang)
+                    dump_sentences(filename, text_lang, cache_folder)
                 if do_audio:
-                    dump_audio(filename, audio_lang)
+                    dump_audio(filename, audio_lang, cache_folder)
+                elif audio_lang is not None:
+                    # The index is tiny, so it is written even if only text is dumped
+                    dump_stream_index(filename, audio_lang, cache_folder)
             elif f.endswith(".core"):
                 print("Unrecognized filename: " + filename)
     except:
@@ -121,26 +120,29 @@ def dump_file(filename: str, do_audio: bool, do_text: bool,
 
 
 def dump_recursive(directory: str, do_audio: bool, do_text: bool,
-                   audio_lang: EAudioLanguages, text_lang: ETextLanguages):
+                   audio_lang: EAudioLanguages, text_lang: ETextLanguages, cache_folder: Optional[str] = None):
     for root, directories, filenames in os.walk(directory):
         for f in filenames:
-            dump_file(os.path.join(root, f), do_audio, do_text, audio_lang, text_lang)
+            dump_file(os.path.join(root, f), do_audio, do_text, audio_lang, text_lang, cache_folder)
 
 
-def dump_audio(filename, language: EAudioLanguages):
-    script_objects = {}
-    pydecima.reader.read_objects(filename, script_objects)
-    sentences = [x for x in script_objects.values() if isinstance(x, SentenceResource) and
-                 x.sound.follow(script_objects).sound_info[language] is not None]
-    missing_sentences = [x for x in script_objects.values() if isinstance(x, SentenceResource) and
-                         x.sound.follow(script_objects).sound_info[language] is None]
+def dump_audio(filename, language: EAudioLanguages, cache_folder: Optional[str] = None):
+    scene = scene_cache.load_scene(filename, cache_folder)
+    sentences = [x for x in scene['sentences'] if x['sound'] is not None and
+                 x['sound']['sound_info'][language] is not None]
+    missing_sentences = [x for x in scene['sentences'] if x['sound'] is None or
+                         x['sound']['sound_info'][language] is None]
     for s in missing_sentences:
-        print(f'{s.name} has no audio in language {language.name}, skipping')
+        print(f'{s["name"]} has no audio in language {language.name}, skipping')
+
+    # Lets the audio for a single line be read straight from the .stream file later
+    stream_index.write_stream_index(scene, os.path.split(filename)[0], language)
 
     if len(sentences) == 0:
         return
 
-    sentences.sort(key=lambda sent: sent.sound.follow(script_objects).sound_info[language].start)
+    # sound_info entries are [start, size, sample count]
+    sentences.sort(key=lambda sent: sent['sound']['sound_info'][language][0])
 
     sound_dir = os.path.join(os.path.split(filename)[0], 'sentences.' + language.name.lower())
     assert (os.path.isfile(sound_dir + '.stream')),\
@@ -149,56 +151,46 @@ def dump_audio(filename, language: EAudioLanguages):
         os.mkdir(sound_dir)
     sound_stream = open(sound_dir + '.stream', 'rb')
     for s in range(len(sentences)):
-        sound = sentences[s].sound.follow(script_objects)
+        sound = sentences[s]['sound']
+        curr_start, curr_size, _ = sound['sound_info'][language]
         if s > 0:
-            prev_sound = sentences[s - 1].sound.follow(script_objects).sound_info[language]
-            curr_sound = sound.sound_info[language]
-            if curr_sound.start == prev_sound.start:
-                print(f'Duplicate sound, {filename}: {sentences[s].name} is identical to {sentences[s - 1].name}')
-            elif curr_sound.start > prev_sound.start + prev_sound.size_1:
+            prev_start, prev_size, _ = sentences[s - 1]['sound']['sound_info'][language]
+            if curr_start == prev_start:
+                print(f'Duplicate sound, {filename}: {sentences[s]["name"]} is identical to {sentences[s - 1]["name"]}')
+            elif curr_start > prev_start + prev_size:
                 print('Unused sound in {}.stream, between {} and {}'.format(
-                    sound_dir, prev_sound.start + prev_sound.size_1, curr_sound.start))
+                    sound_dir, prev_start + prev_size, curr_start))
             else:
-                assert curr_sound.start >= prev_sound.start + prev_sound.size_1,\
+                assert curr_start >= prev_start + prev_size,\
                     f"Overlapping sound files, {filename} is likely broken"
-        ext = 'vgmstream'
-        if sound.audio_type == 0x0b:
-            ext = 'mp3'
-        elif sound.audio_type == 0x09 or sound.audio_type == 0x0d:
-            ext = 'at9'
-        elif sound.audio_type == 0x0f:  # ps4-only
-            ext = 'aac'
-        sound_filename = os.path.join(sound_dir, f'{sentences[s].name}.{ext}')
-        sound_stream.seek(sound.sound_info[language].start)
-        sound_data = sound_stream.read(sound.sound_info[language].size_1)
+        ext = stream_index.get_audio_type_extension(sound['audio_type'])
+        sound_filename = os.path.join(sound_dir, f'{sentences[s]["name"]}.{ext}')
+        sound_stream.seek(curr_start)
+        sound_data = sound_stream.read(curr_size)
 
         with open(sound_filename, 'wb') as sound_out_file:
             sound_out_file.write(sound_data)
 
 
+def dump_stream_index(filename, language: EAudioLanguages, cache_folder: Optional[str] = None):
+    scene = scene_cache.load_scene(filename, cache_folder)
+    stream_index.write_stream_index(scene, os.path.split(filename)[0], language)
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-l", "--language", type=str, help="The language to output text/audio in.",
                         choices=[lang.name for lang in ETextLanguages], default='English')
     parser.add_argument("-d", "--dump", type=str.lower, help="Which type of output to dump; text, audio, or all.",
                         choices=['text', 'audio', 'all'], default='all')
+    parser.add_argument("-c", "--cache", type=str, default=None,
+                        help="Folder to cache parsed sentences.core files in, shared with 03_Build_Transcript.py.")
     parser.add_argument("path", type=str,
                         help="Path to a sentences.core/simpletext.core file, or a directory to recursively dump from.")
     args = parser.parse_args()
     text_language: ETextLanguages = getattr(ETextLanguages, args.language)
 
-    language_lookup = {
-        'Portuguese': EAudioLanguages.Portugese,
-        'LatinAmericanSpanish': EAudioLanguages.LatAmSp,
-        'BrazilianPortuguese': EAudioLanguages.LatAmPor
-    }
-    audio_language: Optional[EAudioLanguages]
-    if hasattr(EAudioLanguages, text_language.name):
-        audio_language = getattr(EAudioLanguages, text_language.name)
-    elif text_language.name in language_lookup:
-        audio_language = language_lookup[text_language.name]
-    else:
-        audio_language = None
+    audio_language: Optional[EAudioLanguages] = scene_cache.get_audio_language(text_language)
 
     audio = args.dump in ['audio', 'all']
     text = args.dump in ['text', 'all']
@@ -211,12 +203,16 @@ def main():
     pydecima.reader.set_globals(_game_root_file=game_root_file, _decima_version='HZDPC')
 
     if os.path.isfile(args.path):
-        dump_file(args.path, audio, text, audio_language, text_language)
+        dump_file(args.path, audio, text, audio_language, text_language, args.cache)
     elif os.path.isdir(args.path):
-        dump_recursive(args.path, audio, text, audio_language, text_language)
+        dump_recursive(args.path, audio, text, audio_language, text_language, args.cache)
     else:
         raise Exception(f'"{args.path}" is not a file or directory.')
 
+    reference_stats = scene_cache.get_reference_stats()
+    print(f'Reference cache: {reference_stats["hits"]} hits in memory, {reference_stats["disk_hits"]} hits on disk, '
+          f'{reference_stats["misses"]} misses')
+
 
 if __name__ == '__main__':
     main()